@@ -1,29 +1,36 @@
-'''
-MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
-    Copyright (C) 2012  University of Auckland
-    
-This file is part of MAP Client. (http://launchpad.net/mapclient)
-
-    MAP Client is free software: you can redistribute it and/or modify
-    it under the terms of the GNU General Public License as published by
-    the Free Software Foundation, either version 3 of the License, or
-    (at your option) any later version.
-
-    MAP Client is distributed in the hope that it will be useful,
-    but WITHOUT ANY WARRANTY; without even the implied warranty of
-    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
-    GNU General Public License for more details.
-
-    You should have received a copy of the GNU General Public License
-    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
-'''
-__version__ = '0.1.1'
-__author__ = 'Hugh Sorby'
-__stepname__ = 'Segmentation'
-__location__ = 'https://github.com/mapclient-plugins/segmentationstep/archive/master.zip'
-
-
-
-# import class that derives itself from the step mountpoint.
-from mapclientplugins.segmentationstep import step
-
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+__version__ = '0.1.1'
+__author__ = 'Hugh Sorby'
+__stepname__ = 'Segmentation'
+__location__ = 'https://github.com/mapclient-plugins/segmentationstep/archive/master.zip'
+
+
+
+# import class that derives itself from the step mountpoint, only when
+# running in MAP Client so the model and batch modules work without it.
+try:
+    import mapclient
+except ImportError:
+    mapclient = None
+
+if mapclient is not None:
+    from mapclientplugins.segmentationstep import step
+
@@ -0,0 +1,280 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import re
+import json
+import uuid
+import queue
+import logging
+import threading
+
+from mapclientplugins.segmentationstep.definitions import DEFAULT_DELTA_COMPACTION_COUNT
+
+logger = logging.getLogger(__name__)
+
+_GENERATION_PATTERN = re.compile(r'\{"_generation":"([0-9a-f]+)",')
+
+
+def writeFileAtomically(filename, text):
+    '''
+    Write the text to a temporary file beside the given file and then
+    rename it over the given file, so a crash while writing leaves
+    either the old file or the new file but never a partial file.
+    '''
+    temporary_filename = filename + '.tmp'
+    with open(temporary_filename, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_filename, filename)
+
+
+def createGeneration():
+    return uuid.uuid4().hex
+
+
+def tagGeneration(text, generation):
+    '''
+    Add the generation to the start of an encoded node model, the
+    change records written after it carry the same generation.
+    '''
+    return '{"_generation":"%s",%s' % (generation, text[1:])
+
+
+def readGeneration(text):
+    match = _GENERATION_PATTERN.match(text)
+
+    return match.group(1) if match else None
+
+
+def readJournal(filename, generation):
+    '''
+    Return the records of the given generation in the given journal
+    file.  A partly written last record, left by a crash while
+    appending, is ignored.  So are records of another generation, left
+    by a crash between writing a snapshot and emptying the journal.
+    '''
+    records = []
+    try:
+        with open(filename, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if isinstance(record, dict) and record.get('_generation') == generation:
+                    records.append(record)
+    except IOError:
+        pass
+
+    return records
+
+
+def getDeltaFilename(filename):
+    return os.path.splitext(filename)[0] + '.delta'
+
+
+def appendRecord(filename, record):
+    with open(filename, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def readSession(filename):
+    '''
+    Return the saved node model in the given file, its generation and
+    the change records of that generation saved after it.
+    '''
+    with open(filename, 'r') as f:
+        text = f.read()
+    generation = readGeneration(text)
+
+    return text, generation, readJournal(getDeltaFilename(filename), generation)
+
+
+def applySession(node_model, text, records):
+    '''
+    Load the node model and the change records, all of them are checked
+    before the model is changed.  Raises ValueError if any is malformed.
+    '''
+    node_model.deserialize(text, records)
+
+
+def loadSession(node_model, filename):
+    '''
+    Load the saved node model from the given file and apply the change
+    records saved after it.  Returns the number of change records.
+    '''
+    text, _, records = readSession(filename)
+    applySession(node_model, text, records)
+
+    return len(records)
+
+
+class DeltaSave(object):
+    '''
+    Saves the node model as a full snapshot followed by a file of the
+    change records of later saves, so a save writes about as much as
+    was changed.  After the compaction count of change records the next
+    save writes a full snapshot again.  The change records carry the
+    generation of the snapshot they follow.
+    '''
+
+    def __init__(self, node_model, filename, compaction_count=DEFAULT_DELTA_COMPACTION_COUNT):
+        self._node_model = node_model
+        self._filename = filename
+        self._delta_filename = getDeltaFilename(filename)
+        self._compaction_count = compaction_count
+        self._delta_count = None
+        self._generation = None
+        self._changes = node_model.createChangeTracker()
+
+    def close(self):
+        '''
+        Stop tracking the changes to the node model, call this when the
+        delta save is no longer used.
+        '''
+        self._node_model.removeChangeTracker(self._changes)
+
+    def getDeltaCount(self):
+        return self._delta_count
+
+    def load(self):
+        self._delta_count = None
+        text, generation, records = readSession(self._filename)
+        applySession(self._node_model, text, records)
+        self._generation = generation
+        self._delta_count = len(records)
+
+    def save(self):
+        '''
+        Append the changes since the last save, or write a full snapshot
+        if this session has not loaded or saved the file before or the
+        change records are due for compaction.
+        '''
+        if self._delta_count is None or self._delta_count >= self._compaction_count or not os.path.exists(self._filename):
+            self.compact()
+        elif self._changes.hasChanges():
+            appendRecord(self._delta_filename, dict(self._node_model.takeChanges(self._changes), _generation=self._generation))
+            self._delta_count += 1
+
+    def reset(self):
+        '''
+        Make the next save write a full snapshot, the model was changed
+        in a way the change records do not cover.
+        '''
+        self._delta_count = None
+
+    def compact(self):
+        self._delta_count = None
+        generation = createGeneration()
+        writeFileAtomically(self._filename, tagGeneration(self._node_model.serialize(), generation))
+        self._generation = generation
+        open(self._delta_filename, 'w').close()
+        self._changes.clear()
+        self._delta_count = 0
+
+
+class Autosave(object):
+    '''
+    Writes snapshots of the model and an append only journal of the
+    changes made after the latest snapshot.  The snapshots are encoded
+    and all the files are written on a worker thread, in the order the
+    requests were made.  Writing a snapshot empties the journal, the
+    journal records carry the generation of the snapshot they follow.
+    '''
+
+    def __init__(self, filename, journal_filename, encode):
+        self._filename = filename
+        self._journal_filename = journal_filename
+        self._encode = encode
+        self._generation = None
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='Autosave')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def getFilename(self):
+        return self._filename
+
+    def getJournalFilename(self):
+        return self._journal_filename
+
+    def hasRecoveryFiles(self):
+        return os.path.exists(self._filename) or os.path.exists(self._journal_filename)
+
+    def saveSnapshot(self, snapshot):
+        self._queue.put((self._writeSnapshot, snapshot))
+
+    def appendJournal(self, record):
+        self._queue.put((self._appendJournal, record))
+
+    def discard(self):
+        '''
+        Remove the snapshot and the journal, the model has been saved.
+        '''
+        self._queue.put((self._discard, None))
+
+    def flush(self):
+        '''
+        Wait until all the requested writes have been done.
+        '''
+        self._queue.join()
+
+    def stop(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _makeDirectory(self, filename):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _writeSnapshot(self, snapshot):
+        self._makeDirectory(self._filename)
+        generation = createGeneration()
+        writeFileAtomically(self._filename, tagGeneration(self._encode(snapshot), generation))
+        self._generation = generation
+        open(self._journal_filename, 'w').close()
+
+    def _appendJournal(self, record):
+        self._makeDirectory(self._journal_filename)
+        appendRecord(self._journal_filename, dict(record, _generation=self._generation))
+
+    def _discard(self, _):
+        self._generation = None
+        for filename in [self._filename, self._journal_filename]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+
+                method, argument = task
+                method(argument)
+            except Exception:
+                logger.exception('Autosave to %s failed', self._filename)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,91 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import sys
+import json
+import argparse
+import multiprocessing
+
+from mapclientplugins.segmentationstep.model.master import SegmentationModel
+from mapclientplugins.segmentationstep.model.image import ImageDirectory
+from mapclientplugins.segmentationstep.autosave import loadSession
+
+
+def processSession(image_directory, output_filename, node_state_filename=None):
+    '''
+    Load the images in the given directory and optionally a saved node
+    state, then write the point cloud including the interpolation points
+    of the curves to the output file.  The file format is taken from the
+    output file extension, one of .ply, .xyz, .csv, .ex or .exnode.
+    No widgets or scenes are created.  Returns the number of points written.
+    '''
+    model = SegmentationModel()
+    model.loadImages(ImageDirectory(image_directory))
+    model.initialize()
+    if node_state_filename is not None:
+        loadSession(model.getNodeModel(), node_state_filename)
+
+    return model.getNodeModel().exportPointCloud(output_filename)
+
+
+def _processJob(job):
+    return processSession(job['images'], job['output'], job.get('node_state'))
+
+
+def processSessions(jobs, processes=None):
+    '''
+    Process a list of jobs, each job is a dict with the keys 'images',
+    'output' and optionally 'node_state'.  Every job runs in its own
+    worker process because a Zinc context is not shared between them.
+    Returns the number of points written for each job.
+    '''
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_processJob, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write the point cloud of saved segmentation sessions without the GUI.')
+    parser.add_argument('images', nargs='?', help='directory of the images to segment')
+    parser.add_argument('output', nargs='?', help='file to write the point cloud to')
+    parser.add_argument('--node-state', help='saved node_state.json to load')
+    parser.add_argument('--jobs', help='JSON file with a list of jobs, each with images, output and optionally node_state')
+    parser.add_argument('--processes', type=int, help='number of worker processes for the jobs, defaults to the CPU count')
+    args = parser.parse_args(argv)
+
+    if args.jobs is not None:
+        with open(args.jobs, 'r') as f:
+            jobs = json.load(f)
+        counts = processSessions(jobs, args.processes)
+        for job, count in zip(jobs, counts):
+            print('%s: %d points' % (job['output'], count))
+    elif args.images is not None and args.output is not None:
+        count = processSession(args.images, args.output, args.node_state)
+        print('%s: %d points' % (args.output, count))
+    else:
+        parser.error('give either an image directory and an output file or a jobs file')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+from PySide6 import QtCore, QtGui, QtOpenGL
+
+from cmlibs.zinc.sceneviewer import Sceneviewer
+
+from mapclientplugins.segmentationstep.model.master import SegmentationModel
+from mapclientplugins.segmentationstep.model.image import ImageDirectory
+from mapclientplugins.segmentationstep.model.curve import CurveModel
+from mapclientplugins.segmentationstep.scene.master import MasterScene
+
+DEFAULT_SESSION_SIZES = [100, 1000, 10000, 100000]
+DEFAULT_FRAME_COUNT = 20
+DEFAULT_VIEWPORT_SIZE = [800, 600]
+DEFAULT_IMAGE_SIZE = [128, 128, 16]
+DEFAULT_NODES_PER_CURVE = 10
+DEFAULT_POINTS_PER_CURVE = 10
+
+
+class OffscreenRenderer(object):
+    '''
+    Renders Zinc scene viewers into a framebuffer object bound
+    to an OpenGL context on an offscreen surface.
+    '''
+
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+        surface_format = QtGui.QSurfaceFormat()
+        surface_format.setDepthBufferSize(24)
+        self._surface = QtGui.QOffscreenSurface()
+        self._surface.setFormat(surface_format)
+        self._surface.create()
+        self._gl_context = QtGui.QOpenGLContext()
+        self._gl_context.setFormat(surface_format)
+        if not self._gl_context.create():
+            raise RuntimeError('Could not create an OpenGL context')
+
+        self._gl_context.makeCurrent(self._surface)
+        fbo_format = QtOpenGL.QOpenGLFramebufferObjectFormat()
+        fbo_format.setAttachment(QtOpenGL.QOpenGLFramebufferObject.CombinedDepthStencil)
+        self._fbo = QtOpenGL.QOpenGLFramebufferObject(width, height, fbo_format)
+
+    def makeCurrent(self):
+        self._gl_context.makeCurrent(self._surface)
+        self._fbo.bind()
+
+    def createSceneviewer(self, context):
+        self.makeCurrent()
+        scene_viewer_module = context.getSceneviewermodule()
+        sceneviewer = scene_viewer_module.createSceneviewer(Sceneviewer.BUFFERING_MODE_DOUBLE, Sceneviewer.STEREO_MODE_DEFAULT)
+        sceneviewer.setProjectionMode(Sceneviewer.PROJECTION_MODE_PERSPECTIVE)
+        filter_module = context.getScenefiltermodule()
+        sceneviewer.setScenefilter(filter_module.createScenefilterVisibilityFlags())
+        sceneviewer.setScene(context.getDefaultRegion().getScene())
+        sceneviewer.setViewportSize(self._width, self._height)
+        sceneviewer.viewAll()
+
+        return sceneviewer
+
+    def renderFrame(self, sceneviewer):
+        '''
+        Render one frame and wait for OpenGL to finish it,
+        returns the time taken in seconds.
+        '''
+        self.makeCurrent()
+        start = time.perf_counter()
+        sceneviewer.renderScene()
+        self._gl_context.functions().glFinish()
+
+        return time.perf_counter() - start
+
+    def toImage(self):
+        self.makeCurrent()
+        return self._fbo.toImage()
+
+
+def createSyntheticImages(directory, size=DEFAULT_IMAGE_SIZE):
+    '''
+    Write a stack of greyscale PNG images to the given directory.
+    '''
+    for index in range(size[2]):
+        image = QtGui.QImage(size[0], size[1], QtGui.QImage.Format_Grayscale8)
+        image.fill(QtGui.QColor.fromRgb(*([int(255 * index / max(size[2] - 1, 1))] * 3)))
+        image.save(os.path.join(directory, 'slice_%04d.png' % index))
+
+
+def createSyntheticSession(model, size, seed=0):
+    '''
+    Fill the node model with roughly the given number of nodes, split
+    between point cloud nodes and closed curves on planes through the image.
+    '''
+    random.seed(seed)
+    node_model = model.getNodeModel()
+    image_model = model.getImageModel()
+    dimensions = image_model.getDimensions()
+    plane_attitude = image_model.getPlane().getAttitude()
+    curve_count = size // (2 * DEFAULT_NODES_PER_CURVE)
+    point_count = size - curve_count * DEFAULT_NODES_PER_CURVE
+
+    fieldmodule = node_model.getRegion().getFieldmodule()
+    fieldmodule.beginChange()
+    point_cloud_group = node_model.getPointCloudGroup()
+    for _ in range(point_count):
+        location = [random.uniform(0.0, dimensions[i]) for i in range(3)]
+        node_id = node_model.addNode(-1, location, plane_attitude)
+        point_cloud_group.addNode(node_model.getNodeByIdentifier(node_id))
+
+    curve_group = node_model.getCurveGroup()
+    radius = 0.4 * min(dimensions[0], dimensions[1])
+    for curve_index in range(curve_count):
+        z = dimensions[2] * (curve_index + 0.5) / curve_count
+        curve = CurveModel(node_model)
+        curve.setInterpolationCount(DEFAULT_POINTS_PER_CURVE)
+        for index in range(DEFAULT_NODES_PER_CURVE):
+            theta = 2 * math.pi * index / DEFAULT_NODES_PER_CURVE
+            location = [dimensions[0] / 2 + radius * math.cos(theta), dimensions[1] / 2 + radius * math.sin(theta), z]
+            node_id = node_model.addNode(-1, location, plane_attitude)
+            curve_group.addNode(node_model.getNodeByIdentifier(node_id))
+            curve.addNode(node_id)
+        curve.addNode(curve.getNodes()[0])
+        node_model.insertCurve(curve_index, curve)
+    fieldmodule.endChange()
+
+
+def _getMemoryUsage():
+    '''
+    Return the resident set size of this process in bytes.
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else None
+
+
+def _getNodeLocationUncached(node_model, node_id):
+    '''
+    Look up a node and evaluate its location with fresh Zinc handles,
+    as the node model accessors did before the handles were cached.
+    '''
+    fieldmodule = node_model.getRegion().getFieldmodule()
+    node = fieldmodule.findNodesetByName('nodes').findNodeByIdentifier(node_id)
+    fieldcache = fieldmodule.createFieldcache()
+    fieldcache.setNode(node)
+    return node_model.getCoordinateField().evaluateReal(fieldcache, 3)[1]
+
+
+def benchmarkNodeAccessors(node_model):
+    '''
+    Time the node model accessors over every node of the model and
+    return the mean time per node in seconds for each accessor.
+    '''
+    node_ids = node_model.getPointCloudArray(include_identifiers=True)[1]
+    node_ids = [int(node_id) for node_id in node_ids if node_id >= 0]
+    if not node_ids:
+        return {}
+
+    start = time.perf_counter()
+    nodes = [node_model.getNodeByIdentifier(node_id) for node_id in node_ids]
+    find_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    locations = [node_model.getNodeLocation(node) for node in nodes]
+    get_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for node, location in zip(nodes, locations):
+        node_model.setNodeLocation(node, location)
+    set_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for node_id in node_ids:
+        _getNodeLocationUncached(node_model, node_id)
+    uncached_time = time.perf_counter() - start
+
+    count = float(len(node_ids))
+    return {'getNodeByIdentifier': find_time / count,
+            'getNodeLocation': get_time / count,
+            'setNodeLocation': set_time / count,
+            'uncached_find_and_get': uncached_time / count}
+
+
+def benchmarkSession(renderer, image_directory, size, frame_count=DEFAULT_FRAME_COUNT):
+    '''
+    Build a synthetic session of the given size and time building the
+    scene, the first frame which also builds the graphics and further frames.
+    '''
+    memory_start = _getMemoryUsage()
+    model = SegmentationModel()
+    model.loadImages(ImageDirectory(image_directory))
+    model.initialize()
+
+    start = time.perf_counter()
+    createSyntheticSession(model, size)
+    session_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scene = MasterScene(model)
+    node_model = model.getNodeModel()
+    node_scene = scene.getNodeScene()
+    for curve_identifier in node_model.getCurveIdentifiers():
+        node_scene.updateCurve(curve_identifier, node_model.getCurveWithIdentifier(curve_identifier))
+    scene_time = time.perf_counter() - start
+    interpolation_point_count = sum(len(node_model.getCurveWithIdentifier(curve_identifier).calculate()) for curve_identifier in node_model.getCurveIdentifiers())
+    accessor_times = benchmarkNodeAccessors(node_model)
+
+    sceneviewer = renderer.createSceneviewer(model.getContext())
+    first_frame_time = renderer.renderFrame(sceneviewer)
+    frame_times = [renderer.renderFrame(sceneviewer) for _ in range(frame_count)]
+
+    return {'size': size,
+            'node_count': node_model.getNodeCount(),
+            'interpolation_point_count': interpolation_point_count,
+            'session_time': session_time,
+            'scene_time': scene_time,
+            'first_frame_time': first_frame_time,
+            'frame_time_median': _median(frame_times),
+            'frame_time_max': max(frame_times) if frame_times else None,
+            'accessor_times': accessor_times,
+            'memory': _getMemoryUsage() - memory_start}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the segmentation scene rendering offscreen.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SESSION_SIZES, help='number of nodes in each synthetic session')
+    parser.add_argument('--frames', type=int, default=DEFAULT_FRAME_COUNT, help='number of frames to time for each session')
+    parser.add_argument('--viewport', type=int, nargs=2, default=DEFAULT_VIEWPORT_SIZE, help='width and height of the offscreen viewport')
+    parser.add_argument('--output', help='file to write the JSON results to, defaults to standard output')
+    args = parser.parse_args(argv)
+
+    # Use the offscreen platform and software OpenGL so this runs on machines without a GPU or display.
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    os.environ.setdefault('LIBGL_ALWAYS_SOFTWARE', '1')
+    QtCore.QCoreApplication.setAttribute(QtCore.Qt.AA_UseSoftwareOpenGL)
+    app = QtGui.QGuiApplication.instance() or QtGui.QGuiApplication(sys.argv[:1])
+
+    image_directory = tempfile.mkdtemp()
+    try:
+        createSyntheticImages(image_directory)
+        renderer = OffscreenRenderer(args.viewport[0], args.viewport[1])
+        results = [benchmarkSession(renderer, image_directory, size, args.frames) for size in args.sizes]
+    finally:
+        shutil.rmtree(image_directory)
+
+    str_rep = json.dumps({'platform': os.environ.get('QT_QPA_PLATFORM'), 'viewport': args.viewport, 'sessions': results}, indent=2)
+    if args.output is None:
+        print(str_rep)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(str_rep)
+
+    del app
+
+
+if __name__ == '__main__':
+    main()
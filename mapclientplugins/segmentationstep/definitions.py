@@ -22,6 +22,27 @@ DEFAULT_GRAPHICS_SPHERE_SIZE = 10.0
 DEFAULT_SEGMENTATION_POINT_SIZE = 2.0
 DEFAULT_PUSH_PULL_STEP_SIZE = 1.0
 DEFAULT_INTERPOLATION_COUNT = 5
+DEFAULT_ON_PLANE_TOLERANCE = 0.5
+DEFAULT_CURVE_ELEMENT_DIVISIONS = 16
+DEFAULT_DATAPOINT_POOL_SIZE = 1000
+DEFAULT_LOD_MEDIUM_NODE_COUNT = 10000
+DEFAULT_LOD_LOW_NODE_COUNT = 100000
+DEFAULT_LOD_MEDIUM_GLYPH_PIXELS = 6.0
+DEFAULT_LOD_LOW_GLYPH_PIXELS = 2.0
+DEFAULT_LOD_CIRCLE_DIVISIONS = 6
+DEFAULT_LOD_POINT_SIZE = 2.0
+DEFAULT_MOUSE_MOVE_INTERVAL = 16
+DEFAULT_LATENCY_BUFFER_SIZE = 1000
+DEFAULT_LATENCY_HISTOGRAM_BINS = 20
+DEFAULT_LATENCY_REFRESH_INTERVAL = 500
+DEFAULT_EXPORT_CHUNK_SIZE = 65536
+DEFAULT_SAMPLE_SPACING = 1.0
+DEFAULT_ARC_LENGTH_TABLE_SIZE = 32
+DEFAULT_SAMPLE_TOLERANCE = 0.1
+DEFAULT_ADAPTIVE_MAXIMUM_DEPTH = 8
+DEFAULT_AUTOSAVE_INTERVAL = 60000
+DEFAULT_AUTOSAVE_JOURNAL_LIMIT = 256
+DEFAULT_DELTA_COMPACTION_COUNT = 32
 
 ELEMENT_NODE_LABEL_GRAPHIC_NAME = 'label_only'
 IMAGE_PLANE_GRAPHIC_NAME = 'image_plane'
@@ -46,6 +67,35 @@ class ViewMode(object):
     PLANE_ROTATION = 4
     SEGMENT_CURVE = 8
 
+class OnPlaneToleranceMode(object):
+
+    FIXED = 1
+    VOXEL_SPACING = 2
+
+class CurveRenderMode(object):
+
+    DATAPOINTS = 1
+    POLYLINE = 2
+    HERMITE = 3
+
+class LevelOfDetail(object):
+
+    HIGH = 1
+    MEDIUM = 2
+    LOW = 3
+
+class SamplingMode(object):
+
+    PARAMETRIC = 1
+    ARC_LENGTH = 2
+    ADAPTIVE = 3
+
+class PointSource(object):
+
+    POINT = 1
+    CURVE_CONTROL = 2
+    INTERPOLATION = 3
+
 class ViewType(object):
 
     VIEW_3D = 'View 3D'
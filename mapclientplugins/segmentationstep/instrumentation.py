@@ -0,0 +1,176 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import json
+import time
+import functools
+from collections import deque
+
+from mapclientplugins.segmentationstep.definitions import DEFAULT_LATENCY_BUFFER_SIZE, DEFAULT_LATENCY_HISTOGRAM_BINS
+
+
+class LatencyRecorder(object):
+    '''
+    Records durations in seconds against a name.  Only the most recent
+    durations for each name are kept in a ring buffer.  Recording is
+    off until the recorder is enabled.
+    '''
+
+    def __init__(self, size=DEFAULT_LATENCY_BUFFER_SIZE):
+        self._enabled = False
+        self._size = size
+        self._samples = {}
+
+    def isEnabled(self):
+        return self._enabled
+
+    def setEnabled(self, enabled):
+        self._enabled = enabled
+
+    def clear(self):
+        self._samples = {}
+
+    def record(self, name, duration):
+        if name not in self._samples:
+            self._samples[name] = deque(maxlen=self._size)
+        self._samples[name].append(duration)
+
+    def getNames(self):
+        return sorted(self._samples.keys())
+
+    def getSamples(self, name):
+        return list(self._samples.get(name, []))
+
+    def percentile(self, name, percent):
+        '''
+        Return the nearest rank percentile of the durations recorded
+        for the given name, or None if nothing has been recorded.
+        '''
+        samples = sorted(self._samples.get(name, []))
+        if not samples:
+            return None
+
+        rank = int(round(percent / 100.0 * (len(samples) - 1)))
+        return samples[rank]
+
+    def histogram(self, name, bin_count=DEFAULT_LATENCY_HISTOGRAM_BINS):
+        '''
+        Return the bin edges and the counts of a histogram of
+        the durations recorded for the given name.
+        '''
+        samples = self._samples.get(name, [])
+        if not samples:
+            return [], []
+
+        minimum = min(samples)
+        maximum = max(samples)
+        width = (maximum - minimum) / bin_count
+        edges = [minimum + i * width for i in range(bin_count + 1)]
+        counts = [0] * bin_count
+        for sample in samples:
+            index = bin_count - 1 if width == 0.0 else min(int((sample - minimum) / width), bin_count - 1)
+            counts[index] += 1
+
+        return edges, counts
+
+    def summary(self):
+        summary = {}
+        for name in self.getNames():
+            summary[name] = {'count': len(self._samples[name]),
+                             'p50': self.percentile(name, 50),
+                             'p99': self.percentile(name, 99),
+                             'max': max(self._samples[name])}
+
+        return summary
+
+    def serialize(self):
+        str_rep = {}
+        summary = self.summary()
+        for name in summary:
+            edges, counts = self.histogram(name)
+            str_rep[name] = dict(summary[name], edges=edges, counts=counts)
+
+        return json.dumps(str_rep)
+
+    def exportJSON(self, filename):
+        with open(filename, 'w') as f:
+            f.write(self.serialize())
+
+
+class _Measurement(object):
+
+    def __init__(self, recorder, name):
+        self._recorder = recorder
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._recorder.record(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _NullMeasurement(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_measurement = _NullMeasurement()
+
+recorder = LatencyRecorder()
+
+
+def measure(name):
+    '''
+    Context manager that records the duration of its block against
+    the given name when the recorder is enabled.
+    '''
+    if recorder.isEnabled():
+        return _Measurement(recorder, name)
+
+    return _null_measurement
+
+
+def timed(name):
+    '''
+    Decorator that records the duration of each call against the
+    given name when the recorder is enabled.
+    '''
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not recorder.isEnabled():
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                recorder.record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
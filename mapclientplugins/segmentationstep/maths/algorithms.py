@@ -99,6 +99,15 @@ def calculateLinePlaneIntersection(pt1, pt2, point_on_plane, plane_normal):
     return None
 
 
+def calculateSpacingAlongNormal(normal, spacing):
+    '''
+    Calculate the thickness of a voxel with the given spacing
+    when it is measured along the direction of the given normal.
+    '''
+    n = normalize(normal)
+    return sum(abs(n[i]) * spacing[i] for i in range(len(n)))
+
+
 def calculateCentroid(point_on_plane, plane_normal, cuboid_dimensions):
     '''
     Takes a description of a plane as a point on the plane 
@@ -19,76 +19,370 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
 '''
 import json
 
-from mapclientplugins.segmentationstep.maths.algorithms import paramerterizedSplines, \
-    evaluatePolynomial
-from mapclientplugins.segmentationstep.definitions import DEFAULT_INTERPOLATION_COUNT
+import numpy as np
+
+from mapclientplugins.segmentationstep.maths.algorithms import paramerterizedSplines
+from mapclientplugins.segmentationstep.definitions import DEFAULT_INTERPOLATION_COUNT, SamplingMode, \
+    DEFAULT_SAMPLE_SPACING, DEFAULT_ARC_LENGTH_TABLE_SIZE, DEFAULT_SAMPLE_TOLERANCE, DEFAULT_ADAPTIVE_MAXIMUM_DEPTH
+from mapclientplugins.segmentationstep.instrumentation import timed
 
 class CurveModel(object):
 
     def __init__(self, node_model):
         self._node_model = node_model
         self._nodes = []
+        self._node_positions = {}
         self._closed = False
         self._interpolation_count = DEFAULT_INTERPOLATION_COUNT
+        self._sampling_mode = SamplingMode.PARAMETRIC
+        self._sample_spacing = DEFAULT_SAMPLE_SPACING
+        self._sample_tolerance = DEFAULT_SAMPLE_TOLERANCE
+        self._data = None
+        self._coefficients = None
+        self._samples = {}
 
     def serialize(self):
         str_rep = '{"_nodes":' + json.dumps(self._nodes) + ', ' \
             + '"_closed":' + json.dumps(self._closed) + ', ' \
-            + '"_interpolation_count":' + json.dumps(self._interpolation_count) + '}'
+            + '"_interpolation_count":' + json.dumps(self._interpolation_count) + ', ' \
+            + '"_sampling_mode":' + json.dumps(self._sampling_mode) + ', ' \
+            + '"_sample_spacing":' + json.dumps(self._sample_spacing) + ', ' \
+            + '"_sample_tolerance":' + json.dumps(self._sample_tolerance) + '}'
 
         return str_rep
 
     def deserialize(self, str_rep):
-        d = json.loads(str_rep)
-        self.__dict__.update(d)
+        self.setState(json.loads(str_rep))
+
+    def setState(self, state):
+        '''
+        Set the curve from a dict of its serialized attributes, missing
+        attributes keep their current values and unknown ones are ignored.
+        '''
+        self._nodes = list(state['_nodes'])
+        self._closed = state.get('_closed', self._closed)
+        self._interpolation_count = state.get('_interpolation_count', self._interpolation_count)
+        self._sampling_mode = state.get('_sampling_mode', self._sampling_mode)
+        self._sample_spacing = state.get('_sample_spacing', self._sample_spacing)
+        self._sample_tolerance = state.get('_sample_tolerance', self._sample_tolerance)
+        self._indexNodes()
+        self.invalidate()
+
+    def _indexNodes(self):
+        '''
+        Rebuild the map from node id to position in the ordered list of
+        nodes, membership tests and removal look nodes up in this map.
+        '''
+        self._node_positions = dict((node_id, index) for index, node_id in enumerate(self._nodes))
+
+    def invalidate(self):
+        '''
+        Forget the cached spline coefficients and samples of this curve,
+        the node model calls this when one of the curve's nodes moves.
+        '''
+        self._data = None
+        self._coefficients = None
+        self._samples = {}
+
+    def invalidateSamples(self):
+        '''
+        Forget the cached samples but keep the spline coefficients, the
+        samples also depend on the sampling settings and the scale.
+        '''
+        self._samples = {}
 
     def getNodes(self):
         return self._nodes
 
     def setNodes(self, node_ids):
+        removed = self._nodes
         self._nodes = node_ids
+        self._indexNodes()
+        self.invalidate()
+        self._node_model.notifyCurveNodesChanged(self, node_ids, removed)
 
     def getInterpolationCount(self):
         return self._interpolation_count
 
     def setInterpolationCount(self, count):
         self._interpolation_count = count
+        self.invalidateSamples()
+        self._node_model.notifyCurveChanged(self)
 
-    def calculate(self):
+    def getSamplingMode(self):
+        return self._sampling_mode
+
+    def setSamplingMode(self, mode):
+        '''
+        In PARAMETRIC mode each segment is sampled at the interpolation
+        count of equally spaced parameter values, in ARC_LENGTH mode the
+        curve is sampled every sample spacing along its length and in
+        ADAPTIVE mode segments are halved until the curve deviates from
+        the chords by less than the sample tolerance.
+        '''
+        self._sampling_mode = mode
+        self.invalidateSamples()
+        self._node_model.notifyCurveChanged(self)
+
+    def getSampleSpacing(self):
+        return self._sample_spacing
+
+    def setSampleSpacing(self, spacing):
+        '''
+        Set the distance between samples in ARC_LENGTH mode, the
+        distance is measured in scaled coordinates.
+        '''
+        self._sample_spacing = spacing
+        self.invalidateSamples()
+        self._node_model.notifyCurveChanged(self)
+
+    def getSampleTolerance(self):
+        return self._sample_tolerance
+
+    def setSampleTolerance(self, tolerance):
+        '''
+        Set the largest distance in scaled coordinates the curve may
+        deviate from the chords between samples in ADAPTIVE mode.
+        '''
+        self._sample_tolerance = tolerance
+        self.invalidateSamples()
+        self._node_model.notifyCurveChanged(self)
+
+    def getSamplingSettings(self):
+        return {'interpolation_count': self._interpolation_count,
+                'sampling_mode': self._sampling_mode,
+                'sample_spacing': self._sample_spacing,
+                'sample_tolerance': self._sample_tolerance}
+
+    def setSamplingSettings(self, settings):
+        self.setInterpolationCount(settings['interpolation_count'])
+        self.setSamplingMode(settings['sampling_mode'])
+        self.setSampleSpacing(settings['sample_spacing'])
+        self.setSampleTolerance(settings['sample_tolerance'])
+
+    def _getControlPointLocations(self):
         data = [self._node_model.getNodeLocation(self._node_model.getNodeByIdentifier(node_id)) for node_id in self._nodes]
         if self.isClosed():
-            data += [self._node_model.getNodeLocation(self._node_model.getNodeByIdentifier(self._nodes[0]))]
-        splines = paramerterizedSplines(data)
-        t = [float(i) / (self._interpolation_count + 1) for i in range(1, self._interpolation_count + 1)]
-        locations = []
-        for pair in splines:
-            xt = pair[0][:]
-            yt = pair[1][:]
-            zt = pair[2][:]
-            for t_i in t:
-                x = evaluatePolynomial(t_i, xt)
-                y = evaluatePolynomial(t_i, yt)
-                z = evaluatePolynomial(t_i, zt)
-                locations.append([x, y, z])
-
-        return locations
+            data += [data[0]]
+
+        return data
+
+    def loadControlPoints(self):
+        '''
+        Read the control point locations from the node model if the
+        spline coefficients are not cached.  Zinc is only used from the
+        main thread, after this the calculate methods only use NumPy and
+        may run on a worker thread.
+        '''
+        if self._coefficients is None and self._data is None:
+            self._data = self._getControlPointLocations()
+
+    def _getCoefficients(self):
+        '''
+        Return the control point locations and the spline coefficients,
+        they are only recalculated after the curve has been invalidated.
+        '''
+        if self._coefficients is None:
+            self.loadControlPoints()
+            self._coefficients = self._calculateCoefficients(self._data)
+
+        return self._data, self._coefficients
+
+    def _calculateCoefficients(self, data):
+        '''
+        Return the cubic polynomial coefficients of the spline through
+        the given data as an array indexed by segment, dimension and power.
+        '''
+        return np.array(list(paramerterizedSplines(data)), dtype=np.float64)
+
+    def _evaluate(self, coefficients, t):
+        '''
+        Evaluate every segment at the given segment parameter values.
+        '''
+        powers = np.vander(np.asarray(t, dtype=np.float64), 4, increasing=True)
+        return np.einsum('tk,sdk->std', powers, coefficients).reshape(-1, 3)
+
+    def _evaluateSegments(self, coefficients, segments, t):
+        '''
+        Evaluate each of the given segments at its own segment parameter value.
+        '''
+        powers = np.vander(t, 4, increasing=True)
+        return np.einsum('sdk,sk->sd', coefficients[segments], powers)
+
+    def _evaluateParameters(self, coefficients, parameters):
+        '''
+        Evaluate the curve at the given curve parameter values, the
+        curve parameter runs from zero to the number of segments.
+        '''
+        segments = np.minimum(parameters.astype(np.int64), len(coefficients) - 1)
+        return self._evaluateSegments(coefficients, segments, parameters - segments)
+
+    def _calculateArcLengthParameters(self, coefficients):
+        '''
+        Return the curve parameter values of the points that are the sample
+        spacing apart along the curve in scaled coordinates.  The curve
+        length is measured from a table of chord lengths per segment
+        and inverted by linear interpolation in that table.
+        '''
+        t = np.linspace(0.0, 1.0, DEFAULT_ARC_LENGTH_TABLE_SIZE + 1)
+        scale = np.asarray(self._node_model.getScale(), dtype=np.float64)
+        powers = np.vander(t, 4, increasing=True)
+        points = np.einsum('tk,sdk->std', powers, coefficients) * scale
+        chords = np.linalg.norm(np.diff(points, axis=1), axis=2).ravel()
+        lengths = np.concatenate([[0.0], np.cumsum(chords)])
+        segment_count = len(coefficients)
+        parameters = np.concatenate([(np.arange(segment_count)[:, np.newaxis] + t[np.newaxis, :-1]).ravel(), [segment_count]])
+        if lengths[-1] <= 0.0 or self._sample_spacing <= 0.0:
+            return np.empty(0)
+
+        targets = np.arange(self._sample_spacing, lengths[-1], self._sample_spacing)
+        return np.interp(targets, lengths, parameters)
+
+    def _calculateAdaptiveParameters(self, coefficients):
+        '''
+        Return the curve parameter values of the samples found by halving
+        the segments until the points at a quarter, half and three quarters
+        of every interval lie within the sample tolerance of the interval's
+        chord in scaled coordinates.  All the intervals at one depth are
+        tested together.  The control points themselves are not included.
+        '''
+        scale = np.asarray(self._node_model.getScale(), dtype=np.float64)
+        fractions = np.array([0.25, 0.5, 0.75])
+        segments = np.arange(len(coefficients))
+        t0 = np.zeros(len(coefficients))
+        t1 = np.ones(len(coefficients))
+        accepted = []
+        for depth in range(DEFAULT_ADAPTIVE_MAXIMUM_DEPTH + 1):
+            if len(segments) == 0:
+                break
+
+            start = self._evaluateSegments(coefficients, segments, t0) * scale
+            chord = self._evaluateSegments(coefficients, segments, t1) * scale - start
+            t = t0[:, np.newaxis] + (t1 - t0)[:, np.newaxis] * fractions
+            repeated_segments = np.repeat(segments, len(fractions))
+            points = self._evaluateSegments(coefficients, repeated_segments, t.ravel()).reshape(-1, len(fractions), 3) * scale
+            offsets = points - start[:, np.newaxis, :]
+            chord_length_squared = np.sum(chord * chord, axis=1)
+            chord_length_squared[chord_length_squared == 0.0] = 1.0
+            projection = np.clip(np.sum(offsets * chord[:, np.newaxis, :], axis=2) / chord_length_squared[:, np.newaxis], 0.0, 1.0)
+            deviation = np.linalg.norm(offsets - projection[:, :, np.newaxis] * chord[:, np.newaxis, :], axis=2).max(axis=1)
+
+            split = deviation > self._sample_tolerance
+            if depth == DEFAULT_ADAPTIVE_MAXIMUM_DEPTH:
+                split[:] = False
+
+            keep = ~split & (t0 > 0.0)
+            accepted.append(segments[keep] + t0[keep])
+            middle = 0.5 * (t0 + t1)
+            segments = np.concatenate([segments[split], segments[split]])
+            t0, t1 = np.concatenate([t0[split], middle[split]]), np.concatenate([middle[split], t1[split]])
+
+        return np.sort(np.concatenate(accepted))
+
+    def _calculateSampleParameters(self, coefficients):
+        if self._sampling_mode == SamplingMode.ADAPTIVE:
+            return self._calculateAdaptiveParameters(coefficients)
+
+        return self._calculateArcLengthParameters(coefficients)
+
+    @timed('CurveModel.calculate')
+    def calculateArray(self):
+        '''
+        Return the interpolation points of this curve as an (N, 3) array,
+        the result is cached and must not be modified.
+        '''
+        if 'locations' not in self._samples:
+            _, coefficients = self._getCoefficients()
+            if self._sampling_mode != SamplingMode.PARAMETRIC:
+                locations = self._evaluateParameters(coefficients, self._calculateSampleParameters(coefficients))
+            else:
+                t = [float(i) / (self._interpolation_count + 1) for i in range(1, self._interpolation_count + 1)]
+                locations = self._evaluate(coefficients, t)
+            self._samples['locations'] = locations.reshape(-1, 3)
+
+        return self._samples['locations']
+
+    def calculate(self):
+        '''
+        Return the interpolation points of this curve as a list, the
+        result is cached and must not be modified.
+        '''
+        if 'calculate' not in self._samples:
+            self._samples['calculate'] = self.calculateArray().tolist()
+
+        return self._samples['calculate']
+
+    def calculatePolyline(self):
+        '''
+        Calculate the vertices of a polyline that passes through the
+        control points and the interpolation points of this curve in order.
+        In ARC_LENGTH mode the polyline runs from the first control point
+        through the samples to the last control point.  The result is
+        cached and must not be modified.
+        '''
+        if 'polyline' not in self._samples:
+            data, coefficients = self._getCoefficients()
+            if self._sampling_mode == SamplingMode.ARC_LENGTH:
+                parameters = np.concatenate([[0.0], self._calculateArcLengthParameters(coefficients), [len(coefficients)]])
+                locations = self._evaluateParameters(coefficients, parameters).tolist()
+            elif self._sampling_mode == SamplingMode.ADAPTIVE:
+                parameters = np.sort(np.concatenate([np.arange(len(coefficients) + 1, dtype=np.float64), self._calculateAdaptiveParameters(coefficients)]))
+                locations = self._evaluateParameters(coefficients, parameters).tolist()
+            else:
+                t = [float(i) / (self._interpolation_count + 1) for i in range(0, self._interpolation_count + 1)]
+                locations = self._evaluate(coefficients, t).tolist()
+                locations.append(data[-1])
+            self._samples['polyline'] = locations
+
+        return self._samples['polyline']
+
+    def calculateHermite(self):
+        '''
+        Calculate the locations and derivatives of the control points
+        of this curve so that a chain of cubic Hermite elements through
+        the control points reproduces the spline.  For a closed curve
+        the last element joins the last control point to the first.
+        '''
+        data, coefficients = self._getCoefficients()
+        locations = coefficients[:, :, 0].tolist()
+        derivatives = coefficients[:, :, 1].tolist()
+        if not self.isClosed():
+            last = coefficients[-1]
+            locations.append(data[-1])
+            derivatives.append((last[:, 1] + 2 * last[:, 2] + 3 * last[:, 3]).tolist())
+
+        return locations, derivatives
 
     def addNode(self, node_id):
         # print(node_id, self._nodes)
-        if node_id not in self._nodes:
+        if node_id not in self._node_positions:
+            self._node_positions[node_id] = len(self._nodes)
             self._nodes.append(node_id)
+            self.invalidate()
+            self._node_model.notifyCurveNodesChanged(self, [node_id], [])
         elif self.closes(node_id):
             self._closed = True
+            self.invalidate()
+            self._node_model.notifyCurveChanged(self)
 
     def removeNode(self, node_id):
-        if node_id in self._nodes:
-                index = self._nodes.index(node_id)
+        if node_id in self._node_positions:
+                index = self._node_positions[node_id]
+                removed = self._nodes[index:]
                 del self._nodes[index:]
+                for removed_node_id in removed:
+                    del self._node_positions[removed_node_id]
                 self._closed = False
+                self.invalidate()
+                self._node_model.notifyCurveNodesChanged(self, [], removed)
 
     def removeAllNodes(self):
+        removed = self._nodes
         self._nodes = []
+        self._node_positions = {}
         self._closed = False
+        self.invalidate()
+        self._node_model.notifyCurveNodesChanged(self, [], removed)
 
     def closes(self, node_id):
         cl = False
@@ -107,6 +401,6 @@ class CurveModel(object):
         return len(self._nodes)
 
     def __contains__(self, key):
-        return key in self._nodes
+        return key in self._node_positions
 
 
@@ -0,0 +1,175 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import os
+
+import numpy as np
+
+POINT_CLOUD_DTYPE = np.dtype([('location', np.float64, (3,)),
+                              ('identifier', np.int64),
+                              ('source', np.int8),
+                              ('curve', np.int32),
+                              ('attitude', np.int32)])
+
+
+class PointCloudWriter(object):
+    '''
+    Writes point cloud chunks to an open file as they arrive, a chunk
+    is an array with the POINT_CLOUD_DTYPE.  Nothing is kept between
+    chunks other than counts so memory use does not grow with the cloud.
+    '''
+
+    binary = False
+
+    def __init__(self, f):
+        self._file = f
+        self._count = 0
+
+    def begin(self):
+        pass
+
+    def writeChunk(self, chunk):
+        self._count += len(chunk)
+
+    def end(self):
+        pass
+
+    def getCount(self):
+        return self._count
+
+
+class XYZWriter(PointCloudWriter):
+
+    delimiter = ' '
+
+    def writeChunk(self, chunk):
+        np.savetxt(self._file, chunk['location'], fmt='%.17g', delimiter=self.delimiter)
+        super(XYZWriter, self).writeChunk(chunk)
+
+
+class CSVWriter(PointCloudWriter):
+
+    def begin(self):
+        self._file.write('x,y,z,identifier,source,curve,attitude\n')
+
+    def writeChunk(self, chunk):
+        columns = np.empty(len(chunk), dtype=[('x', np.float64), ('y', np.float64), ('z', np.float64),
+                                              ('identifier', np.int64), ('source', np.int8), ('curve', np.int32), ('attitude', np.int32)])
+        for index, name in enumerate(['x', 'y', 'z']):
+            columns[name] = chunk['location'][:, index]
+        for name in ['identifier', 'source', 'curve', 'attitude']:
+            columns[name] = chunk[name]
+        np.savetxt(self._file, columns, fmt=['%.17g', '%.17g', '%.17g', '%d', '%d', '%d', '%d'], delimiter=',')
+        super(CSVWriter, self).writeChunk(chunk)
+
+
+class PLYWriter(PointCloudWriter):
+    '''
+    Binary little endian PLY.  The number of vertices is not known until
+    the end so the header reserves a fixed width for it and the count
+    is written over the reserved space once all the chunks are written.
+    '''
+
+    binary = True
+    _count_width = 20
+    _vertex_dtype = np.dtype([('x', '<f8'), ('y', '<f8'), ('z', '<f8'),
+                              ('identifier', '<i4'), ('source', 'i1'), ('curve', '<i4'), ('attitude', '<i4')])
+
+    def begin(self):
+        self._file.write(b'ply\nformat binary_little_endian 1.0\n')
+        self._count_offset = self._file.tell() + len(b'element vertex ')
+        self._file.write(b'element vertex ' + b' ' * self._count_width + b'\n')
+        self._file.write(b'property double x\nproperty double y\nproperty double z\n'
+                         b'property int identifier\nproperty char source\n'
+                         b'property int curve\nproperty int attitude\nend_header\n')
+
+    def writeChunk(self, chunk):
+        vertices = np.empty(len(chunk), dtype=self._vertex_dtype)
+        for index, name in enumerate(['x', 'y', 'z']):
+            vertices[name] = chunk['location'][:, index]
+        for name in ['identifier', 'source', 'curve', 'attitude']:
+            vertices[name] = chunk[name]
+        self._file.write(vertices.tobytes())
+        super(PLYWriter, self).writeChunk(chunk)
+
+    def end(self):
+        end_position = self._file.tell()
+        self._file.seek(self._count_offset)
+        self._file.write(str(self._count).ljust(self._count_width).encode('ascii'))
+        self._file.seek(end_position)
+
+
+class EXWriter(PointCloudWriter):
+    '''
+    Zinc EX node file.  Interpolation points have no node identifier
+    so they are numbered on from the largest node identifier written.
+    '''
+
+    def begin(self):
+        self._file.write(' Group name: point_cloud\n')
+        self._file.write(' #Fields=4\n')
+        self._file.write(' 1) coordinates, coordinate, rectangular cartesian, #Components=3\n')
+        for index, component in enumerate(['x', 'y', 'z']):
+            self._file.write('   %s.  Value index= %d, #Derivatives= 0\n' % (component, index + 1))
+        for index, name in enumerate(['source', 'curve', 'attitude']):
+            self._file.write(' %d) %s, field, rectangular cartesian, #Components=1\n' % (index + 2, name))
+            self._file.write('   1.  Value index= %d, #Derivatives= 0\n' % (index + 4))
+        self._next_identifier = 1
+
+    def writeChunk(self, chunk):
+        identifiers = chunk['identifier'].copy()
+        unnumbered = identifiers < 0
+        if np.any(~unnumbered):
+            self._next_identifier = max(self._next_identifier, int(identifiers[~unnumbered].max()) + 1)
+        identifiers[unnumbered] = np.arange(self._next_identifier, self._next_identifier + np.count_nonzero(unnumbered))
+        self._next_identifier += np.count_nonzero(unnumbered)
+        for identifier, point in zip(identifiers, chunk):
+            location = point['location']
+            self._file.write(' Node: %d\n  %.17g %.17g %.17g\n  %d\n  %d\n  %d\n' % (identifier, location[0], location[1], location[2],
+                                                                                point['source'], point['curve'], point['attitude']))
+        super(EXWriter, self).writeChunk(chunk)
+
+
+POINT_CLOUD_WRITERS = {'.ply': PLYWriter,
+                       '.xyz': XYZWriter,
+                       '.csv': CSVWriter,
+                       '.ex': EXWriter,
+                       '.exnode': EXWriter}
+
+
+def exportPointCloud(chunks, filename, writer_class=None):
+    '''
+    Stream the point cloud chunks to the given file, the file format is
+    taken from the file extension unless a writer class is given.
+    Returns the number of points written.
+    '''
+    if writer_class is None:
+        extension = os.path.splitext(filename)[1].lower()
+        if extension not in POINT_CLOUD_WRITERS:
+            raise ValueError('No point cloud writer for files with the extension "%s"' % extension)
+        writer_class = POINT_CLOUD_WRITERS[extension]
+
+    with open(filename, 'wb' if writer_class.binary else 'w') as f:
+        writer = writer_class(f)
+        writer.begin()
+        for chunk in chunks:
+            writer.writeChunk(chunk)
+        writer.end()
+
+    return writer.getCount()
@@ -0,0 +1,112 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+from array import array
+from bisect import bisect_right
+
+
+class IdentifierSet(object):
+    '''
+    Set of integer identifiers stored as sorted, disjoint, half open
+    ranges [start, stop) in an array of ints.  Zinc node identifiers are
+    mostly contiguous so a selection of many nodes takes little memory.
+    '''
+
+    def __init__(self, identifiers=()):
+        self._starts = array('i')
+        self._stops = array('i')
+        for identifier in sorted(set(identifiers)):
+            if len(self._stops) and self._stops[-1] == identifier:
+                self._stops[-1] = identifier + 1
+            else:
+                self._starts.append(identifier)
+                self._stops.append(identifier + 1)
+
+    @classmethod
+    def fromRanges(cls, ranges):
+        '''
+        Create an identifier set from sorted, disjoint, non adjacent
+        [start, stop) ranges.
+        '''
+        identifier_set = cls()
+        for start, stop in ranges:
+            identifier_set._starts.append(start)
+            identifier_set._stops.append(stop)
+
+        return identifier_set
+
+    def ranges(self):
+        return zip(self._starts, self._stops)
+
+    def getRangeCount(self):
+        return len(self._starts)
+
+    def __len__(self):
+        return sum(self._stops) - sum(self._starts)
+
+    def __bool__(self):
+        return len(self._starts) > 0
+
+    def __iter__(self):
+        for start, stop in self.ranges():
+            for identifier in range(start, stop):
+                yield identifier
+
+    def __contains__(self, identifier):
+        index = bisect_right(self._starts, identifier) - 1
+        return index >= 0 and identifier < self._stops[index]
+
+    def __eq__(self, other):
+        return isinstance(other, IdentifierSet) and self._starts == other._starts and self._stops == other._stops
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'IdentifierSet.fromRanges(' + repr(list(self.ranges())) + ')'
+
+    def union(self, other):
+        return self._combine(other, lambda a, b: a or b)
+
+    def intersection(self, other):
+        return self._combine(other, lambda a, b: a and b)
+
+    def difference(self, other):
+        return self._combine(other, lambda a, b: a and not b)
+
+    def _combine(self, other, keep):
+        '''
+        Sweep over the range boundaries of both sets and keep the
+        stretches where keep(in self, in other) is true.
+        '''
+        boundaries = sorted(set(self._starts) | set(self._stops) | set(other._starts) | set(other._stops))
+        ranges = []
+        for index in range(len(boundaries) - 1):
+            start = boundaries[index]
+            if keep(start in self, start in other):
+                if ranges and ranges[-1][1] == start:
+                    ranges[-1][1] = boundaries[index + 1]
+                else:
+                    ranges.append([start, boundaries[index + 1]])
+
+        return IdentifierSet.fromRanges(ranges)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
@@ -27,6 +27,19 @@ from mapclientplugins.segmentationstep.zincutils import createFiniteElementField
 from mapclientplugins.segmentationstep.misc import alphanum_key
 
 
+class ImageDirectory(object):
+    '''
+    Stands in for the image source port data when there is no
+    workflow, the image model only needs the location of the images.
+    '''
+
+    def __init__(self, location):
+        self._location = location
+
+    def location(self):
+        return self._location
+
+
 class ImageModel(AbstractModel):
     '''
     A model of the image region containing a 
@@ -17,8 +17,6 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     You should have received a copy of the GNU General Public License
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
-from PySide6 import QtGui
-
 from cmlibs.zinc.context import Context
 from cmlibs.zinc.material import Material
 
@@ -29,7 +27,7 @@ class SegmentationModel(object):
 
     def __init__(self):
         self._context = Context('Segmentation')
-        self._undo_redo_stack = QtGui.QUndoStack()
+        self._undo_redo_stack = None
 
         self.defineStandardMaterials()
         self._createModeMaterials()
@@ -45,6 +43,7 @@ class SegmentationModel(object):
         self._image_model.initialize()
         self._node_model.setPlane(self._image_model.getPlane())
         self._node_model.initialize()
+        self._node_model.setScale(self._image_model.getScale())
 
     def getContext(self):
         return self._context
@@ -52,7 +51,18 @@ class SegmentationModel(object):
     def getPointCloud(self):
         return self._node_model.getPointCloud()
 
+    def getPointCloudArray(self, include_identifiers=False, include_labels=False):
+        return self._node_model.getPointCloudArray(include_identifiers, include_labels)
+
     def getUndoRedoStack(self):
+        '''
+        The undo redo stack is created when first asked for, it needs Qt
+        and the model is also used without Qt by the batch entry point.
+        '''
+        if self._undo_redo_stack is None:
+            from mapclientplugins.segmentationstep.undoredo import UndoRedoStack
+            self._undo_redo_stack = UndoRedoStack()
+
         return self._undo_redo_stack
 
     def getImageModel(self):
@@ -18,6 +18,10 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
 import json
+import time
+import heapq
+
+import numpy as np
 
 from cmlibs.zinc.status import OK
 
@@ -26,21 +30,73 @@ from mapclientplugins.segmentationstep.zincutils import createFiniteElementField
 from mapclientplugins.segmentationstep.segmentpoint import SegmentPointStatus
 from mapclientplugins.segmentationstep.model.curve import CurveModel
 from mapclientplugins.segmentationstep.plane import PlaneAttitude
+from mapclientplugins.segmentationstep.maths.algorithms import calculateSpacingAlongNormal
+from mapclientplugins.segmentationstep.definitions import DEFAULT_ON_PLANE_TOLERANCE, OnPlaneToleranceMode, \
+    DEFAULT_DATAPOINT_POOL_SIZE, PointSource, DEFAULT_EXPORT_CHUNK_SIZE
+from mapclientplugins.segmentationstep.model.export import POINT_CLOUD_DTYPE, exportPointCloud
+from mapclientplugins.segmentationstep.model.nodestate import NODE_STATE_VERSION, parseNodeState, parseChangeRecords
+
+class ChangeTracker(object):
+    '''
+    The identifiers of the nodes and curves of a node model that
+    changed since the tracker was last cleared.
+    '''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._node_ids = set()
+        self._curve_identifiers = set()
+
+    def hasChanges(self):
+        return bool(self._node_ids or self._curve_identifiers)
+
+    def addNode(self, node_id):
+        self._node_ids.add(node_id)
+
+    def addCurve(self, curve_identifier):
+        self._curve_identifiers.add(curve_identifier)
+
+    def getNodeIdentifiers(self):
+        return self._node_ids
+
+    def getCurveIdentifiers(self):
+        return self._curve_identifiers
+
 
 class NodeModel(AbstractModel):
 
     def __init__(self, context):
         super(NodeModel, self).__init__(context)
-        self._attributes_that_auto_serialize = [ "_nodes", "_plane_attitudes"]
         self._plane = None
         self._plane_attitude_store = []
+        self._plane_attitude_indices = {}
+        self._free_plane_attitude_indices = []
         self._plane_attitudes = {}
         self._nodes = {}
         self._curves = {}
+        self._curve_identifiers = {}
+        self._node_curve_identifiers = {}
+        self._next_curve_identifier = 0
+        self._scale = [1.0, 1.0, 1.0]
+        self._on_plane_tolerance_mode = OnPlaneToleranceMode.VOXEL_SPACING
+        self._on_plane_tolerance = DEFAULT_ON_PLANE_TOLERANCE
+        self._current_on_plane_tolerance = None
+        self._on_plane_tolerance_field = None
         self._on_plane_conditional_field = None
         self._on_plane_point_cloud_field = None
         self._on_plane_curve_field = None
         self._on_plane_interpolation_point_field = None
+        self._datapoint_template = None
+        self._datapoint_pool = []
+        self._datapoint_pool_size = DEFAULT_DATAPOINT_POOL_SIZE
+        self._change_trackers = []
+        self._load_statistics = {}
+        self._fieldmodule = None
+        self._nodeset = None
+        self._node_templates = {}
+        self._fieldcache = None
 
     def setPlane(self, plane):
         self._plane = plane
@@ -51,126 +107,238 @@ class NodeModel(AbstractModel):
         self._on_plane_point_cloud_field = self._createOnPlanePointCloudField()
         self._on_plane_curve_field = self._createOnPlaneCurveField()
         self._on_plane_interpolation_point_field = self._createOnPlaneInterpolation()
+        self._plane.notifyChange.addObserver(self._planeChanged)
 
     def getPointCloud(self):
-        cloud = []
-        node_nodeset = self._point_cloud_group.getMasterNodeset()
-        datapoint_nodeset = self._interpolation_point_group.getMasterNodeset()
-        def _getLocations(nodeset):
-            locations = []
-            ni = nodeset.createNodeiterator()
-            node = ni.next()
-            while node.isValid():
-                locations.append(self.getNodeLocation(node))
-                node = ni.next()
+        return self.getPointCloudArray().tolist()
 
-            return locations
+    def getPointCloudArray(self, include_identifiers=False, include_labels=False):
+        '''
+        Return the locations of all the nodes followed by the interpolation
+        points of the curves as an (N, 3) array.  If asked for, an array of
+        node identifiers and an array of PointSource labels are returned
+        after the locations, interpolation points have the identifier -1.
+        '''
+        identifiers, locations = self.readNodesetCoordinates(self._nodeset)
+        curve_identifiers = self.readNodesetCoordinates(self._curve_group)[0]
+        labels = np.where(np.isin(identifiers, curve_identifiers), PointSource.CURVE_CONTROL, PointSource.POINT).astype(np.int8)
+        index = len(identifiers)
+
+        # The interpolation points are calculated from the curves because
+        # the node scene does not always represent them with datapoints.
+        interpolation_points = [curve.calculateArray() for curve in self._curves.values() if len(curve) > 1]
+        if interpolation_points:
+            interpolation_points = np.concatenate(interpolation_points)
+            interpolation_count = len(interpolation_points)
+            locations = np.concatenate([locations[:index], interpolation_points])
+            identifiers = np.concatenate([identifiers[:index], np.full(interpolation_count, -1, dtype=np.int64)])
+            labels = np.concatenate([labels[:index], np.full(interpolation_count, PointSource.INTERPOLATION, dtype=np.int8)])
+
+        result = [locations]
+        if include_identifiers:
+            result.append(identifiers)
+        if include_labels:
+            result.append(labels)
+
+        return result[0] if len(result) == 1 else tuple(result)
+
+    def iteratePointCloudChunks(self, chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+        '''
+        Yield the nodes followed by the interpolation points of the curves
+        in chunks of at most chunk_size points with the POINT_CLOUD_DTYPE.
+        The same buffer is reused for every chunk so a chunk must be
+        consumed before the next one is requested.  Points that are not
+        on a curve have the curve identifier -1, interpolation points
+        have the node identifier and the plane attitude index -1.
+        '''
+        buffer = np.empty(chunk_size, dtype=POINT_CLOUD_DTYPE)
+        index = 0
+        for identifiers, locations in self.iterateNodesetCoordinates(self._nodeset, chunk_size):
+            index = len(identifiers)
+            points = buffer[:index]
+            points['location'] = locations
+            points['identifier'] = identifiers
+            points['curve'] = np.fromiter((self._node_curve_identifiers.get(node_id, -1) for node_id in identifiers), dtype=np.int32, count=index)
+            points['source'] = np.where(points['curve'] == -1, PointSource.POINT, PointSource.CURVE_CONTROL)
+            points['attitude'] = np.fromiter((self._nodes.get(node_id, -1) for node_id in identifiers), dtype=np.int32, count=index)
+            if index == chunk_size:
+                yield buffer
+                index = 0
 
-        cloud += _getLocations(node_nodeset)
-        cloud += _getLocations(datapoint_nodeset)
-        return cloud
+        for curve_identifier in self._curves:
+            curve = self._curves[curve_identifier]
+            if len(curve) < 2:
+                continue
+
+            locations = curve.calculateArray()
+            start = 0
+            while start < len(locations):
+                count = min(chunk_size - index, len(locations) - start)
+                points = buffer[index:index + count]
+                points['location'] = locations[start:start + count]
+                points['identifier'] = -1
+                points['source'] = PointSource.INTERPOLATION
+                points['curve'] = curve_identifier
+                points['attitude'] = -1
+                index += count
+                start += count
+                if index == chunk_size:
+                    yield buffer
+                    index = 0
+
+        if index > 0:
+            yield buffer[:index]
+
+    def exportPointCloud(self, filename, writer_class=None, chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+        '''
+        Stream the point cloud to a PLY, XYZ, CSV or EX file, the format
+        is taken from the file extension unless a writer class is given.
+        Returns the number of points written.
+        '''
+        return exportPointCloud(self.iteratePointCloudChunks(chunk_size), filename, writer_class)
 
-    def _serializeNodeset(self, group):
-        str_rep = ''
-        ni = group.createNodeiterator()
-        node = ni.next()
-        while node.isValid():
-            str_rep += '"' + str(node.getIdentifier()) + '":' + json.dumps(self.getNodeLocation(node))
-            node = ni.next()
-            if node.isValid():
-                str_rep += ','
+    def readNodesetCoordinates(self, nodeset):
+        '''
+        Return an array of the identifiers and an (N, 3) array of the
+        locations of the nodes in the given nodeset or nodeset group.
+        '''
+        node_count = nodeset.getSize()
+        if node_count == 0:
+            return np.empty(0, dtype=np.int64), np.empty((0, 3), dtype=np.float64)
 
-        return str_rep
+        for identifiers, locations in self.iterateNodesetCoordinates(nodeset, node_count):
+            return identifiers, locations
 
-    def _serializeSelection(self):
-        node_ids = []
-        ni = self._group.createNodeiterator()
+    def iterateNodesetCoordinates(self, nodeset, chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+        '''
+        Yield an array of the identifiers and an (N, 3) array of the
+        locations of the nodes in the given nodeset or nodeset group in
+        chunks of at most chunk_size nodes.  The coordinates are evaluated
+        with one field cache straight into arrays that are reused for every
+        chunk, so a chunk must be consumed before the next one is requested.
+        The values are exactly those of evaluateReal, a Zinc EX stream only
+        writes 16 significant digits which does not round trip a double.
+        '''
+        identifiers = np.empty(chunk_size, dtype=np.int64)
+        locations = np.empty((chunk_size, 3), dtype=np.float64)
+        fieldcache = self._fieldcache
+        evaluate = self._coordinate_field.evaluateReal
+
+        ni = nodeset.createNodeiterator()
         node = ni.next()
+        index = 0
         while node.isValid():
-            node_ids.append(node.getIdentifier())
+            fieldcache.setNode(node)
+            _, locations[index] = evaluate(fieldcache, 3)
+            identifiers[index] = node.getIdentifier()
+            index += 1
+            if index == chunk_size:
+                yield identifiers, locations
+                index = 0
             node = ni.next()
 
-        return json.dumps(node_ids)
+        if index > 0:
+            yield identifiers[:index], locations[:index]
+
+    def snapshot(self):
+        '''
+        Copy the state of the model into plain Python and NumPy objects.
+        Taking a snapshot is cheap enough for the GUI thread, encodeSnapshot
+        turns it into the serialized form and may run on any thread.
+        '''
+        return {'_basic_points': self.readNodesetCoordinates(self._point_cloud_group),
+                '_curve_points': self.readNodesetCoordinates(self._curve_group),
+                '_selection': self.readNodesetCoordinates(self._group)[0],
+                '_plane': {'normal': list(self._plane.getNormal()), 'point': list(self._plane.getRotationPoint())},
+                '_curves': dict((curve_index, self._curves[curve_index].serialize()) for curve_index in self._curves),
+                '_plane_attitude_store': [None if plane_attitude is None else plane_attitude.serialize() for plane_attitude in self._plane_attitude_store],
+                '_nodes': dict((str(node_id), index) for node_id, index in self._nodes.items()),
+                '_plane_attitudes': dict((str(index), sorted(node_ids)) for index, node_ids in self._plane_attitudes.items())}
 
     def serialize(self):
-        str_rep = '{'
-        str_rep += '"_basic_points":{' + self._serializeNodeset(self._point_cloud_group)
-        str_rep += '},'
-        str_rep += '"_curve_points":{' + self._serializeNodeset(self._curve_group)
-        str_rep += '},'
-        str_rep += '"_selection":' + self._serializeSelection()
-        str_rep += ','
-        str_rep += '"_plane":' + self._plane.serialize() + ','
-        str_rep += '"_curves":{ '  # this space after the curly bracket is very important do not remove it.
-        for curve_index in self._curves:
-            str_rep += '"' + str(curve_index) + '":' + self._curves[curve_index].serialize() + ','
-        str_rep = str_rep[:-1] + '},'
-        str_rep += '"_plane_attitude_store":['
-        for plane_attitude in self._plane_attitude_store:
-            str_rep += plane_attitude.serialize()
-            if plane_attitude != self._plane_attitude_store[-1]:
-                str_rep += ', '
-        str_rep += '],'
-
-        for attr in self._attributes_that_auto_serialize:
-            str_rep += '"' + attr + '":' + json.dumps(getattr(self, attr))
-            if attr != self._attributes_that_auto_serialize[-1]:
-                str_rep += ','
-
-        str_rep += '}'
-        return str_rep
-
-    def _deserializeNodeset(self, group, data):
-        for node_id in data:
-            node = self._createNodeAtLocation(data[node_id], group.getName(), int(node_id))
+        return encodeSnapshot(self.snapshot())
+
+    def _createNodes(self, group, identifiers, locations):
+        fieldmodule = self._region.getFieldmodule()
+        fieldmodule.beginChange()
+        nodeset = group.getMasterNodeset()
+        template = nodeset.createNodetemplate()
+        template.defineField(self._coordinate_field)
+        fieldcache = fieldmodule.createFieldcache()
+        for node_id, location in zip(identifiers, locations):
+            node = nodeset.createNode(node_id, template)
+            fieldcache.setNode(node)
+            self._coordinate_field.assignReal(fieldcache, location)
             group.addNode(node)
+        fieldmodule.endChange()
 
-    def _deserializeSelection(self, data):
-        for node_id in data:
-            node = self.getNodeByIdentifier(node_id)
-            self._group.addNode(node)
+    def deserialize(self, str_rep, records=()):
+        '''
+        Replace the state of the model with the serialized state and then
+        apply the given change records from takeChanges.  The serialized
+        state and the records are checked by parseNodeState and
+        parseChangeRecords before the model is changed, a malformed state
+        or record raises ValueError and leaves the model as it was.
+        Statistics of the load are kept for getLoadStatistics.
+        '''
+        start = time.perf_counter()
+        state = parseNodeState(str_rep)
+        records = parseChangeRecords(state['curve_points'][0], state['curves'], records)
+        parsed = time.perf_counter()
 
-    def deserialize(self, str_rep):
         scene = self._region.getScene()
         scene.beginChange()
         master_nodeset = self._point_cloud_group.getMasterNodeset()  # removeAllNodes()
         master_nodeset.destroyAllNodes()
         master_nodeset = self._interpolation_point_group.getMasterNodeset()
         master_nodeset.destroyAllNodes()
+        self._datapoint_pool = []
         self.setSelection([])
 
-        d = json.loads(str_rep)
-
-        self._deserializeNodeset(self._point_cloud_group, d['_basic_points'])
-        del d['_basic_points']
-        self._deserializeNodeset(self._curve_group, d['_curve_points'])
-        del d['_curve_points']
-        self._plane.deserialize(json.dumps(d['_plane']))
-        del d['_plane']
-        self._curves = {}
-        curves = d['_curves']
-        for curve_index in curves:
+        self._createNodes(self._point_cloud_group, *state['basic_points'])
+        self._createNodes(self._curve_group, *state['curve_points'])
+        self._plane.deserialize(json.dumps(state['plane']))
+        self._clearCurves()
+        for curve_identifier, curve_state in state['curves'].items():
             c = CurveModel(self)
-            c.deserialize(json.dumps(curves[curve_index]))
-            self.insertCurve(int(curve_index), c)
-        del d['_curves']
-        self._plane_attitude_store = []
-        plane_attitude_store = d['_plane_attitude_store']
-        for plane_attitude in plane_attitude_store:
-            p = PlaneAttitude(None, None)
-            p.deserialize(json.dumps(plane_attitude))
-            self._plane_attitude_store.append(p)
-        del d['_plane_attitude_store']
-        selection = d['_selection']
+            c.setState(curve_state)
+            self.insertCurve(curve_identifier, c)
+        self._plane_attitude_store = [None if attitude is None else PlaneAttitude(*attitude) for attitude in state['attitudes']]
+        self._plane_attitude_indices = dict((plane_attitude, index) for index, plane_attitude in enumerate(self._plane_attitude_store) if plane_attitude is not None)
+        self._free_plane_attitude_indices = [index for index, plane_attitude in enumerate(self._plane_attitude_store) if plane_attitude is None]
+        self._nodes = dict(state['node_attitudes'])
+        self._plane_attitudes = {}
+        for node_id, index in self._nodes.items():
+            self._plane_attitudes.setdefault(index, set()).add(node_id)
+
         selection_field = scene.getSelectionField()
         if not selection_field.isValid():
             scene.setSelectionField(self._selection_group_field)
-        del d['_selection']
-
-        self.__dict__.update(d)
-        self.setSelection(selection)
+        self.setSelection(state['selection'])
+        for record in records:
+            self._applyChangeRecord(record)
+        self.clearChanges()
         scene.endChange()
 
+        built = time.perf_counter()
+        self._load_statistics = {'version': state['version'],
+                                 'bytes': len(str_rep),
+                                 'basic_points': len(state['basic_points'][0]),
+                                 'curve_points': len(state['curve_points'][0]),
+                                 'curves': len(state['curves']),
+                                 'change_records': len(records),
+                                 'plane_attitudes': len(self._plane_attitudes),
+                                 'parse_time': parsed - start,
+                                 'build_time': built - parsed}
+
+    def getLoadStatistics(self):
+        '''
+        Return a dict describing the latest deserialize, with the file
+        version, the number of bytes, points, curves and plane attitudes
+        read and the seconds taken to parse and to build the model.
+        '''
+        return self._load_statistics
+
     def _setupNodeRegion(self):
         self._region = self._context.getDefaultRegion().createChild('point_cloud')
 #         scene = self._region.getScene()
@@ -187,6 +355,11 @@ class NodeModel(AbstractModel):
         selectiongroup = self._selection_group_field.createFieldNodeGroup(nodeset)
         self._group = selectiongroup.getNodesetGroup()
 
+        # Scratch group the scene picker adds picked nodes to
+        self._pick_group_field = fieldmodule.createFieldGroup()
+        pickgroup = self._pick_group_field.createFieldNodeGroup(nodeset)
+        self._pick_group = pickgroup.getNodesetGroup()
+
         # Setup the point cloud fields
         self._point_cloud_group_field = fieldmodule.createFieldGroup()
         pointcloudgroup = self._point_cloud_group_field.createFieldNodeGroup(nodeset)
@@ -203,20 +376,67 @@ class NodeModel(AbstractModel):
         self._interpolation_point_group = segmentationpointgroup.getNodesetGroup()
 
         fieldmodule.endChange()
+        self.invalidateHandles()
+
+    def invalidateHandles(self):
+        '''
+        Fetch the fieldmodule, the nodes nodeset and a field cache of the
+        region again, the handles are kept between calls because the node
+        accessors are called for every node.  Call this if the region or
+        the coordinate field of the model is replaced.
+        '''
+        self._fieldmodule = self._region.getFieldmodule()
+        self._nodeset = self._fieldmodule.findNodesetByName('nodes')
+        self._node_templates = {}
+        self._fieldcache = self._fieldmodule.createFieldcache()
+
+    def _getNodeTemplate(self, dataset):
+        '''
+        Return the named nodeset and a node template for it that
+        defines the coordinate field.
+        '''
+        if dataset not in self._node_templates:
+            nodeset = self._fieldmodule.findNodesetByName(dataset)
+            template = nodeset.createNodetemplate()
+            template.defineField(self._coordinate_field)
+            self._node_templates[dataset] = (nodeset, template)
+
+        return self._node_templates[dataset]
 
     def _createOnPlaneConditionalField(self):
         fieldmodule = self._region.getFieldmodule()
         fieldmodule.beginChange()
 
+        self._current_on_plane_tolerance = self._calculateOnPlaneTolerance()
+        self._on_plane_tolerance_field = fieldmodule.createFieldConstant(self._current_on_plane_tolerance)
+        on_plane_field = self._createOnPlaneField(fieldmodule, self._scaled_coordinate_field, self._on_plane_tolerance_field)
+
+        fieldmodule.endChange()
+        return on_plane_field
+
+    def createOnPlaneConditionalField(self, region, scaled_coordinate_field):
+        '''
+        Create the on plane conditional field for a child region of this
+        model's region.  The tolerance is shared with this model so the
+        child region follows any change to the on plane tolerance.
+        '''
+        fieldmodule = region.getFieldmodule()
+        fieldmodule.beginChange()
+
+        tolerance_field = fieldmodule.createFieldAlias(self._on_plane_tolerance_field)
+        on_plane_field = self._createOnPlaneField(fieldmodule, scaled_coordinate_field, tolerance_field)
+
+        fieldmodule.endChange()
+        return on_plane_field
+
+    def _createOnPlaneField(self, fieldmodule, scaled_coordinate_field, tolerance_field):
         alias_normal_field = fieldmodule.createFieldAlias(self._plane.getNormalField())
         alias_point_field = fieldmodule.createFieldAlias(self._plane.getRotationPointField())
 
-        plane_equation_field = _createPlaneEquationField(fieldmodule, self._scaled_coordinate_field, alias_normal_field, alias_point_field)
-        tolerance_field = fieldmodule.createFieldConstant(0.5)
+        plane_equation_field = _createPlaneEquationField(fieldmodule, scaled_coordinate_field, alias_normal_field, alias_point_field)
         abs_field = fieldmodule.createFieldAbs(plane_equation_field)
         on_plane_field = fieldmodule.createFieldLessThan(abs_field, tolerance_field)
 
-        fieldmodule.endChange()
         return on_plane_field
 
     def _createOnPlanePointCloudField(self):
@@ -249,9 +469,60 @@ class NodeModel(AbstractModel):
         this way we can ensure that the two scale fields have the same
         values.
         '''
-        fieldmodule = self._region.getFieldmodule()
-        fieldcache = fieldmodule.createFieldcache()
-        self._scale_field.assignReal(fieldcache, scale)
+        self._fieldmodule.beginChange()
+        self._scale_field.assignReal(self._fieldcache, scale)
+        self._scale = scale[:]
+        self._updateOnPlaneTolerance()
+        for curve in self._curves.values():
+            curve.invalidateSamples()
+        self._fieldmodule.endChange()
+
+    def getScale(self):
+        return self._scale
+
+    def getScaleField(self):
+        return self._scale_field
+
+    def getOnPlaneToleranceMode(self):
+        return self._on_plane_tolerance_mode
+
+    def setOnPlaneToleranceMode(self, mode):
+        '''
+        In FIXED mode the on plane tolerance is the value set with
+        setOnPlaneTolerance, in VOXEL_SPACING mode the tolerance
+        is half the voxel spacing along the current plane normal.
+        '''
+        self._on_plane_tolerance_mode = mode
+        self._updateOnPlaneTolerance()
+
+    def getOnPlaneTolerance(self):
+        return self._on_plane_tolerance
+
+    def setOnPlaneTolerance(self, tolerance):
+        self._on_plane_tolerance = tolerance
+        self._updateOnPlaneTolerance()
+
+    def _calculateOnPlaneTolerance(self):
+        if self._on_plane_tolerance_mode == OnPlaneToleranceMode.VOXEL_SPACING:
+            return 0.5 * calculateSpacingAlongNormal(self._plane.getNormal(), self._scale)
+
+        return self._on_plane_tolerance
+
+    def _updateOnPlaneTolerance(self):
+        '''
+        Only touch the tolerance field when the value actually changes,
+        plane changes are frequent and most of them are not rotations.
+        '''
+        if self._on_plane_tolerance_field is None:
+            return
+
+        tolerance = self._calculateOnPlaneTolerance()
+        if tolerance != self._current_on_plane_tolerance:
+            self._on_plane_tolerance_field.assignReal(self._fieldcache, tolerance)
+            self._current_on_plane_tolerance = tolerance
+
+    def _planeChanged(self):
+        self._updateOnPlaneTolerance()
 
     def getPointCloudGroupField(self):
         return self._point_cloud_group_field
@@ -265,6 +536,15 @@ class NodeModel(AbstractModel):
     def getCurveGroup(self):
         return self._curve_group
 
+    def getNodeCount(self):
+        '''
+        Return the number of nodes and visible interpolation datapoints.
+        '''
+        return self._point_cloud_group.getMasterNodeset().getSize() + self._interpolation_point_group.getSize()
+
+    def getInterpolationPointGroupField(self):
+        return self._interpolation_point_group_field
+
     def getInterpolationPointGroup(self):
         return self._interpolation_point_group
 
@@ -272,7 +552,7 @@ class NodeModel(AbstractModel):
         return self._on_plane_point_cloud_field
 
     def getOnPlaneInterpolationField(self):
-        return self._on_plane_conditional_field
+        return self._on_plane_interpolation_point_field
 
     def getOnPlaneCurveField(self):
         return self._on_plane_curve_field
@@ -299,6 +579,69 @@ class NodeModel(AbstractModel):
 
         return selection
 
+    def getPickGroupField(self):
+        return self._pick_group_field
+
+    def getPickGroup(self):
+        return self._pick_group
+
+    def clearPickGroup(self):
+        self._pick_group_field.clear()
+
+    def calculateSelectionDelta(self, exclusive, toggle=False):
+        '''
+        Return the lists of node ids added to and removed from the
+        selection by selecting the nodes in the pick group.  An exclusive
+        selection removes the selected nodes that were not picked, a toggle
+        selection removes the picked nodes that were already selected.
+        Only the picked nodes, and for an exclusive selection the selected
+        nodes, are visited.  The pick group is cleared afterwards.
+        '''
+        added = []
+        removed = []
+        ni = self._pick_group.createNodeiterator()
+        node = ni.next()
+        while node.isValid():
+            if not self._group.containsNode(node):
+                added.append(node.getIdentifier())
+            elif toggle:
+                removed.append(node.getIdentifier())
+            node = ni.next()
+
+        if exclusive:
+            ni = self._group.createNodeiterator()
+            node = ni.next()
+            while node.isValid():
+                if not self._pick_group.containsNode(node):
+                    removed.append(node.getIdentifier())
+                node = ni.next()
+
+        self.clearPickGroup()
+
+        return added, removed
+
+    def applySelectionDelta(self, added, removed):
+        '''
+        Add and remove the given iterables of node ids from the selection
+        in one change and move the plane to the first selected node, as
+        setSelection does.
+        '''
+        fieldmodule = self._region.getFieldmodule()
+        nodeset = self._group.getMasterNodeset()
+        fieldmodule.beginChange()
+        for node_id in removed:
+            self._group.removeNode(nodeset.findNodeByIdentifier(node_id))
+        for node_id in added:
+            self._group.addNode(nodeset.findNodeByIdentifier(node_id))
+
+        ni = self._group.createNodeiterator()
+        node = ni.next()
+        if node.isValid() and (added or removed):
+            plane_attitude = self.getNodePlaneAttitude(node.getIdentifier())
+            self._plane.setPlaneEquation(plane_attitude.getNormal(), plane_attitude.getPoint())
+
+        fieldmodule.endChange()
+
     def setSelection(self, selection):
         fieldmodule = self._region.getFieldmodule()
         nodeset = self._group.getMasterNodeset()  # fieldmodule.findNodesetByName('nodes')
@@ -314,13 +657,10 @@ class NodeModel(AbstractModel):
         fieldmodule.endChange()
 
     def getNodeByIdentifier(self, node_id):
-        fieldmodule = self._region.getFieldmodule()
-        nodeset = fieldmodule.findNodesetByName('nodes')
-        node = nodeset.findNodeByIdentifier(node_id)
-        return node
+        return self._nodeset.findNodeByIdentifier(node_id)
 
     def getNodePlaneAttitude(self, node_id):
-        return self._plane_attitude_store[self._nodes[str(node_id)]]
+        return self._plane_attitude_store[self._nodes[node_id]]
 
     def getNodeStatus(self, node_id):
         node = self.getNodeByIdentifier(node_id)
@@ -328,26 +668,36 @@ class NodeModel(AbstractModel):
         return node_status
 
     def _addId(self, plane_attitude, node_id):
-        if plane_attitude in self._plane_attitude_store:
-            index = self._plane_attitude_store.index(plane_attitude)
-            self._plane_attitudes[str(index)].append(node_id)
+        '''
+        Add the node to the nodes of the plane attitude and return the
+        index of the plane attitude in the store.  A new plane attitude
+        takes the lowest free index in the store.
+        '''
+        if plane_attitude in self._plane_attitude_indices:
+            index = self._plane_attitude_indices[plane_attitude]
+            self._plane_attitudes[index].add(node_id)
         else:
-            if None in self._plane_attitude_store:
-                index = self._plane_attitude_store.index(None)
+            if self._free_plane_attitude_indices:
+                index = heapq.heappop(self._free_plane_attitude_indices)
                 self._plane_attitude_store[index] = plane_attitude
             else:
                 index = len(self._plane_attitude_store)
                 self._plane_attitude_store.append(plane_attitude)
 
-            self._plane_attitudes[str(index)] = [node_id]
+            self._plane_attitude_indices[plane_attitude] = index
+            self._plane_attitudes[index] = set([node_id])
+
+        return index
 
     def _removeId(self, plane_attitude, node_id):
-        plane_attitude_index = self._plane_attitude_store.index(plane_attitude)
-        index = self._plane_attitudes[str(plane_attitude_index)].index(node_id)
-        del self._plane_attitudes[str(plane_attitude_index)][index]
-        if len(self._plane_attitudes[str(plane_attitude_index)]) == 0:
-            del self._plane_attitudes[str(plane_attitude_index)]
+        plane_attitude_index = self._plane_attitude_indices[plane_attitude]
+        node_ids = self._plane_attitudes[plane_attitude_index]
+        node_ids.discard(node_id)
+        if not node_ids:
+            del self._plane_attitudes[plane_attitude_index]
+            del self._plane_attitude_indices[plane_attitude]
             self._plane_attitude_store[plane_attitude_index] = None
+            heapq.heappush(self._free_plane_attitude_indices, plane_attitude_index)
 
     def getElementByIdentifier(self, element_id):
         fieldmodule = self._region.getFieldmodule()
@@ -357,19 +707,68 @@ class NodeModel(AbstractModel):
         return mesh.findElementByIdentifier(element_id)
 
     def getNextCurveIdentifier(self):
-        next_identifier = 0
-        while next_identifier in self._curves:
-            next_identifier += 1
+        '''
+        Return the lowest curve identifier that is not in use, the
+        search starts from the lowest identifier that may be free.
+        '''
+        while self._next_curve_identifier in self._curves:
+            self._next_curve_identifier += 1
+
+        return self._next_curve_identifier
 
-        return next_identifier
+    def _clearCurves(self):
+        self._curves = {}
+        self._curve_identifiers = {}
+        self._node_curve_identifiers = {}
+        self._next_curve_identifier = 0
 
     def insertCurve(self, curve_identifier, curve):
+        if curve_identifier in self._curves:
+            self._forgetCurve(curve_identifier)
         self._curves[curve_identifier] = curve
+        self._curveChanged(curve_identifier)
+        self._curve_identifiers[curve] = curve_identifier
+        for node_id in curve.getNodes():
+            self._node_curve_identifiers[node_id] = curve_identifier
+
+    def _forgetCurve(self, curve_identifier):
+        curve = self._curves.pop(curve_identifier)
+        del self._curve_identifiers[curve]
+        self._curveChanged(curve_identifier)
+        for node_id in curve.getNodes():
+            if self._node_curve_identifiers.get(node_id) == curve_identifier:
+                del self._node_curve_identifiers[node_id]
+        self._next_curve_identifier = min(self._next_curve_identifier, curve_identifier)
+
+        return curve
+
+    def notifyCurveNodesChanged(self, curve, added_node_ids, removed_node_ids):
+        '''
+        Keep the node id to curve identifier map up to date, the curve
+        calls this when nodes are added to it or removed from it.
+        '''
+        curve_identifier = self._curve_identifiers.get(curve)
+        if curve_identifier is None:
+            return
+
+        self._curveChanged(curve_identifier)
+        for node_id in removed_node_ids:
+            if self._node_curve_identifiers.get(node_id) == curve_identifier:
+                del self._node_curve_identifiers[node_id]
+        for node_id in added_node_ids:
+            self._node_curve_identifiers[node_id] = curve_identifier
+
+    def notifyCurveChanged(self, curve):
+        '''
+        Record that the state of the curve other than its nodes changed.
+        '''
+        curve_identifier = self._curve_identifiers.get(curve)
+        if curve_identifier is not None:
+            self._curveChanged(curve_identifier)
 
     def popCurve(self, curve_identifier):
         if curve_identifier in self._curves:
-            curve = self._curves[curve_identifier]
-            del self._curves[curve_identifier]
+            curve = self._forgetCurve(curve_identifier)
             node_ids = curve.getNodes()
             for node_id in node_ids:
                 self.removeNode(node_id)
@@ -379,29 +778,24 @@ class NodeModel(AbstractModel):
         return self._curves.keys()
 
     def getCurveIdentifier(self, curve):
-        for curve_identifier in self._curves:
-            if curve == self._curves[curve_identifier]:
-                return curve_identifier
-
-        return None
+        return self._curve_identifiers.get(curve)
 
     def getCurveWithIdentifier(self, index):
         return self._curves[index]
 
     def getCurveForNode(self, node_id):
-        for curve_identifier in self._curves:
-            curve = self._curves[curve_identifier]
-            if node_id in curve:
-                return curve
+        curve_identifier = self._node_curve_identifiers.get(node_id)
+        if curve_identifier is None:
+            return None
 
-        return None
+        return self._curves[curve_identifier]
 
     def addNode(self, node_id, location, plane_attitude):
         if node_id == -1:
             node = self._createNodeAtLocation(location)
             node_id = node.getIdentifier()
-        self._addId(plane_attitude, node_id)
-        self._nodes[str(node_id)] = self._plane_attitude_store.index(plane_attitude)
+        self._nodes[node_id] = self._addId(plane_attitude, node_id)
+        self._nodeChanged(node_id)
 
         return node_id
 
@@ -417,29 +811,141 @@ class NodeModel(AbstractModel):
         fieldmodule.endChange()
 
     def modifyNode(self, node_id, location, plane_attitude):
-        current_plane_attitude = self._plane_attitude_store[self._nodes[str(node_id)]]
+        current_plane_attitude = self._plane_attitude_store[self._nodes[node_id]]
         node = self.getNodeByIdentifier(node_id)
         self.setNodeLocation(node, location)
         if current_plane_attitude != plane_attitude:
             self._removeId(current_plane_attitude, node_id)
-            self._addId(plane_attitude, node_id)
-            self._nodes[str(node_id)] = self._plane_attitude_store.index(plane_attitude)
+            self._nodes[node_id] = self._addId(plane_attitude, node_id)
+        self._nodeChanged(node_id)
 
     def setNodeLocation(self, node, location):
+        '''
+        Move a node of the model, the change is recorded and the curve
+        through the node is invalidated.  Use setDatapointLocation to
+        move a datapoint.
+        '''
+        self._assignLocation(node, location)
+        node_id = node.getIdentifier()
+        curve_identifier = self._node_curve_identifiers.get(node_id)
+        if curve_identifier is not None:
+            self._nodeChanged(node_id)
+            self._curves[curve_identifier].invalidate()
+        elif node_id in self._nodes:
+            self._nodeChanged(node_id)
+
+    def setDatapointLocation(self, datapoint, location):
+        self._assignLocation(datapoint, location)
+
+    def _assignLocation(self, node, location):
+        self._fieldcache.setNode(node)
+        self._coordinate_field.assignReal(self._fieldcache, location)
+
+    def createChangeTracker(self):
+        '''
+        Create a change tracker that records the nodes and curves changed
+        from now on, each user of the changes has a tracker of its own.
+        '''
+        tracker = ChangeTracker()
+        self._change_trackers.append(tracker)
+
+        return tracker
+
+    def removeChangeTracker(self, tracker):
+        if tracker in self._change_trackers:
+            self._change_trackers.remove(tracker)
+
+    def _nodeChanged(self, node_id):
+        for tracker in self._change_trackers:
+            tracker.addNode(node_id)
+
+    def _curveChanged(self, curve_identifier):
+        for tracker in self._change_trackers:
+            tracker.addCurve(curve_identifier)
+
+    def clearChanges(self):
+        for tracker in self._change_trackers:
+            tracker.clear()
+
+    def takeChanges(self, tracker):
+        '''
+        Return a record of the current state of the nodes and curves that
+        changed since the tracker was cleared and clear it, a removed node
+        or curve is recorded as None.  The plane attitudes of the nodes
+        are listed once each.  The record is plain JSON data for applyChanges.
+        '''
+        attitudes = []
+        attitude_indices = {}
+        nodes = {}
+        for node_id in tracker.getNodeIdentifiers():
+            if node_id in self._nodes:
+                node = self.getNodeByIdentifier(node_id)
+                source = PointSource.CURVE_CONTROL if self._curve_group.containsNode(node) else PointSource.POINT
+                store_index = self._nodes[node_id]
+                if store_index not in attitude_indices:
+                    plane_attitude = self._plane_attitude_store[store_index]
+                    attitude_indices[store_index] = len(attitudes)
+                    attitudes.append([plane_attitude.getPoint(), plane_attitude.getNormal()])
+                nodes[str(node_id)] = [source, self.getNodeLocation(node), attitude_indices[store_index]]
+            else:
+                nodes[str(node_id)] = None
+        curves = {}
+        for curve_identifier in tracker.getCurveIdentifiers():
+            curves[str(curve_identifier)] = self._curves[curve_identifier].serialize() if curve_identifier in self._curves else None
+        tracker.clear()
+
+        return {'_attitudes': attitudes,
+                '_nodes': nodes,
+                '_curves': curves,
+                '_plane': {'normal': list(self._plane.getNormal()), 'point': list(self._plane.getRotationPoint())}}
+
+    def applyChanges(self, record):
+        '''
+        Bring the nodes and curves in the given record from takeChanges
+        to the recorded state.  The record is checked by parseChangeRecords
+        before the model is changed, a malformed record raises ValueError.
+        '''
+        curve_node_ids = self.readNodesetCoordinates(self._curve_group)[0].tolist()
+        curves = dict((curve_identifier, {'_nodes': curve.getNodes()}) for curve_identifier, curve in self._curves.items())
+        self._applyChangeRecord(parseChangeRecords(curve_node_ids, curves, [record])[0])
+
+    def _applyChangeRecord(self, record):
+        attitudes = [PlaneAttitude(point, normal) for point, normal in record['attitudes']]
         fieldmodule = self._region.getFieldmodule()
-        fieldcache = fieldmodule.createFieldcache()
         fieldmodule.beginChange()
-        fieldcache.setNode(node)
-        self._coordinate_field.assignReal(fieldcache, location)
+        for node_id, state in record['nodes'].items():
+            if state is None:
+                if node_id in self._nodes:
+                    self.removeNode(node_id)
+                continue
+
+            source, location, attitude_index = state
+            group = self._curve_group if source == PointSource.CURVE_CONTROL else self._point_cloud_group
+            if node_id in self._nodes:
+                # Update the node in place, it keeps its selection.
+                self.modifyNode(node_id, location, attitudes[attitude_index])
+                node = self.getNodeByIdentifier(node_id)
+                if not group.containsNode(node):
+                    other_group = self._point_cloud_group if source == PointSource.CURVE_CONTROL else self._curve_group
+                    other_group.removeNode(node)
+                    group.addNode(node)
+            else:
+                node = self._createNodeAtLocation(location, 'nodes', node_id)
+                group.addNode(node)
+                self.addNode(node_id, location, attitudes[attitude_index])
+        for curve_identifier, state in record['curves'].items():
+            if curve_identifier in self._curves:
+                self._forgetCurve(curve_identifier)
+            if state is not None:
+                c = CurveModel(self)
+                c.setState(state)
+                self.insertCurve(curve_identifier, c)
+        self._plane.deserialize(json.dumps(record['plane']))
         fieldmodule.endChange()
 
     def getNodeLocation(self, node):
-        fieldmodule = self._region.getFieldmodule()
-        fieldcache = fieldmodule.createFieldcache()
-        fieldmodule.beginChange()
-        fieldcache.setNode(node)
-        result, location = self._coordinate_field.evaluateReal(fieldcache, 3)
-        fieldmodule.endChange()
+        self._fieldcache.setNode(node)
+        result, location = self._coordinate_field.evaluateReal(self._fieldcache, 3)
 
         if result == OK:
             return location
@@ -459,6 +965,62 @@ class NodeModel(AbstractModel):
         self._interpolation_point_group.addNode(node)
         return node
 
+    def getDatapointPoolSize(self):
+        return self._datapoint_pool_size
+
+    def setDatapointPoolSize(self, size):
+        self._datapoint_pool_size = size
+        surplus = self._datapoint_pool[size:]
+        self._datapoint_pool = self._datapoint_pool[:size]
+        fieldmodule = self._region.getFieldmodule()
+        fieldmodule.beginChange()
+        for datapoint in surplus:
+            self.removeDatapoint(datapoint)
+        fieldmodule.endChange()
+
+    def acquireDatapoint(self, location):
+        '''
+        Get a datapoint at the given location from the pool of hidden
+        datapoints, a new datapoint is only created when the pool is
+        empty.  The datapoint is visible through the interpolation
+        point group until it is released.
+        '''
+        fieldmodule = self._region.getFieldmodule()
+        fieldmodule.beginChange()
+        if self._datapoint_pool:
+            datapoint = self._datapoint_pool.pop()
+        else:
+            if self._datapoint_template is None:
+                datapointset = self._interpolation_point_group.getMasterNodeset()
+                self._datapoint_template = datapointset.createNodetemplate()
+                self._datapoint_template.defineField(self._coordinate_field)
+            datapoint = self._interpolation_point_group.getMasterNodeset().createNode(-1, self._datapoint_template)
+        self.setDatapointLocation(datapoint, location)
+        self._interpolation_point_group.addNode(datapoint)
+        fieldmodule.endChange()
+
+        return datapoint
+
+    def releaseDatapoints(self, datapoints):
+        '''
+        Hide the given datapoints by taking them out of the interpolation
+        point group and keep them for reuse, once the pool is full any
+        further datapoints are destroyed.  Datapoints that are no longer
+        in the interpolation point group are ignored.
+        '''
+        fieldmodule = self._region.getFieldmodule()
+        fieldmodule.beginChange()
+        for datapoint in datapoints:
+            if not self._interpolation_point_group.containsNode(datapoint):
+                continue
+
+            self._interpolation_point_group.removeNode(datapoint)
+            if len(self._datapoint_pool) < self._datapoint_pool_size:
+                self._datapoint_pool.append(datapoint)
+            else:
+                self.removeDatapoint(datapoint)
+        fieldmodule.endChange()
+
     def removeNodes(self, node_statuses):
         fieldmodule = self._region.getFieldmodule()
         fieldmodule.beginChange()
@@ -469,10 +1031,11 @@ class NodeModel(AbstractModel):
         fieldmodule.endChange()
 
     def removeNode(self, node_id):
-        if str(node_id) in self._nodes:
-            plane_attitude = self._plane_attitude_store[self._nodes[str(node_id)]]
+        if node_id in self._nodes:
+            plane_attitude = self._plane_attitude_store[self._nodes[node_id]]
             self._removeId(plane_attitude, node_id)
-            del self._nodes[str(node_id)]
+            del self._nodes[node_id]
+        self._nodeChanged(node_id)
 
         node = self.getNodeByIdentifier(node_id)
         nodeset = node.getNodeset()
@@ -519,15 +1082,11 @@ class NodeModel(AbstractModel):
         Creates a node at the given location without
         adding it to the current selection.
         '''
-        fieldmodule = self._region.getFieldmodule()
-        fieldmodule.beginChange()
-
-        nodeset = fieldmodule.findNodesetByName(dataset)
-        template = nodeset.createNodetemplate()
-        template.defineField(self._coordinate_field)
+        self._fieldmodule.beginChange()
+        nodeset, template = self._getNodeTemplate(dataset)
         node = nodeset.createNode(node_id, template)
-        self.setNodeLocation(node, location)
-        fieldmodule.endChange()
+        self._assignLocation(node, location)
+        self._fieldmodule.endChange()
 
         return node
 
@@ -537,6 +1096,31 @@ class NodeModel(AbstractModel):
         nodeset.destroyNode(datapoint)
 
 
+def _encodeNodeset(identifiers, locations):
+    return json.dumps(dict(zip([str(identifier) for identifier in identifiers.tolist()], locations.tolist())))
+
+
+def encodeSnapshot(snapshot):
+    '''
+    Encode a snapshot from NodeModel.snapshot in the form read by
+    NodeModel.deserialize.  Only plain Python and NumPy objects are
+    used, so this may run on a worker thread.
+    '''
+    str_rep = '{'
+    str_rep += '"_version":' + str(NODE_STATE_VERSION) + ','
+    str_rep += '"_basic_points":' + _encodeNodeset(*snapshot['_basic_points']) + ','
+    str_rep += '"_curve_points":' + _encodeNodeset(*snapshot['_curve_points']) + ','
+    str_rep += '"_selection":' + json.dumps(snapshot['_selection'].tolist()) + ','
+    str_rep += '"_plane":' + json.dumps(snapshot['_plane']) + ','
+    str_rep += '"_curves":{' + ','.join(['"' + str(curve_index) + '":' + curve for curve_index, curve in snapshot['_curves'].items()]) + '},'
+    str_rep += '"_plane_attitude_store":[' + ', '.join(['null' if plane_attitude is None else plane_attitude for plane_attitude in snapshot['_plane_attitude_store']]) + '],'
+    str_rep += '"_nodes":' + json.dumps(snapshot['_nodes']) + ','
+    str_rep += '"_plane_attitudes":' + json.dumps(snapshot['_plane_attitudes'])
+    str_rep += '}'
+
+    return str_rep
+
+
 def _createPlaneEquationField(fieldmodule, coordinate_field, plane_normal_field, point_on_plane_field):
     d = fieldmodule.createFieldDotProduct(plane_normal_field, point_on_plane_field)
     plane_equation_field = fieldmodule.createFieldDotProduct(coordinate_field, plane_normal_field) - d
@@ -0,0 +1,273 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import json
+import numbers
+
+from mapclientplugins.segmentationstep.definitions import SamplingMode, PointSource
+
+# Version 1 files have no _version entry.
+NODE_STATE_VERSION = 2
+
+_SAMPLING_MODES = (SamplingMode.PARAMETRIC, SamplingMode.ARC_LENGTH, SamplingMode.ADAPTIVE)
+_POINT_SOURCES = (PointSource.POINT, PointSource.CURVE_CONTROL)
+
+
+def _fail(message, *args):
+    raise ValueError('Invalid node state: ' + message % args)
+
+
+def _checkType(value, expected, name):
+    if not isinstance(value, expected) or isinstance(value, bool) and expected is not bool:
+        _fail('%s must be a %s', name, expected.__name__ if isinstance(expected, type) else 'number')
+
+
+def _checkIdentifier(value, name):
+    try:
+        identifier = int(value)
+    except (TypeError, ValueError):
+        _fail('%s %r is not an integer identifier', name, value)
+    if isinstance(value, (bool, float)) or identifier < 0:
+        _fail('%s %r is not an integer identifier', name, value)
+
+    return identifier
+
+
+def _checkVector(value, name):
+    if not isinstance(value, list) or len(value) != 3 or not all(isinstance(v, numbers.Real) and not isinstance(v, bool) for v in value):
+        _fail('%s must be a list of three numbers', name)
+
+    return [float(v) for v in value]
+
+
+def _readNodeset(data, name):
+    _checkType(data, dict, name)
+    identifiers = []
+    locations = []
+    for key, location in data.items():
+        identifiers.append(_checkIdentifier(key, name + ' node'))
+        locations.append(_checkVector(location, name + ' location'))
+
+    return identifiers, locations
+
+
+def _readCurve(data, node_ids, name):
+    _checkType(data, dict, name)
+    curve = {}
+    _checkType(data.get('_nodes'), list, name + ' _nodes')
+    curve['_nodes'] = [_checkIdentifier(node_id, name + ' node') for node_id in data['_nodes']]
+    if len(set(curve['_nodes'])) != len(curve['_nodes']):
+        _fail('%s lists a node more than once', name)
+    for node_id in curve['_nodes']:
+        if node_ids is not None and node_id not in node_ids:
+            _fail('%s node %d is not a curve point', name, node_id)
+    if '_closed' in data:
+        _checkType(data['_closed'], bool, name + ' _closed')
+        curve['_closed'] = data['_closed']
+    if '_interpolation_count' in data:
+        _checkType(data['_interpolation_count'], int, name + ' _interpolation_count')
+        curve['_interpolation_count'] = max(0, data['_interpolation_count'])
+    if '_sampling_mode' in data:
+        if data['_sampling_mode'] not in _SAMPLING_MODES:
+            _fail('%s has an unknown sampling mode %r', name, data['_sampling_mode'])
+        curve['_sampling_mode'] = data['_sampling_mode']
+    for key in ['_sample_spacing', '_sample_tolerance']:
+        if key in data:
+            _checkType(data[key], numbers.Real, name + ' ' + key)
+            curve[key] = float(data[key])
+
+    return curve
+
+
+def _readPlane(data, name):
+    _checkType(data, dict, name)
+
+    return {'normal': _checkVector(data.get('normal'), name + ' normal'),
+            'point': _checkVector(data.get('point'), name + ' point')}
+
+
+def _readPlaneAttitude(data, name):
+    if data is None:
+        return None
+
+    _checkType(data, dict, name)
+
+    return _checkVector(data.get('_point'), name + ' point'), _checkVector(data.get('_normal'), name + ' normal')
+
+
+def parseNodeState(str_rep):
+    '''
+    Parse and check a serialized node model before any of it is used.
+    Every version up to NODE_STATE_VERSION is read.  Identifiers become
+    integers, unknown entries are ignored and plane attitudes without
+    nodes are dropped.  Raises ValueError if the state is malformed or
+    inconsistent.
+    '''
+    try:
+        d = json.loads(str_rep)
+    except ValueError as e:
+        _fail('%s', e)
+    _checkType(d, dict, 'node state')
+
+    version = d.get('_version', 1)
+    _checkType(version, int, '_version')
+    if version > NODE_STATE_VERSION:
+        _fail('version %d is newer than the supported version %d', version, NODE_STATE_VERSION)
+
+    for key in ['_basic_points', '_curve_points', '_plane', '_curves', '_plane_attitude_store', '_nodes']:
+        if key not in d:
+            _fail('%s is missing', key)
+
+    state = {'version': version}
+    state['basic_points'] = _readNodeset(d['_basic_points'], '_basic_points')
+    state['curve_points'] = _readNodeset(d['_curve_points'], '_curve_points')
+    basic_ids = set(state['basic_points'][0])
+    curve_ids = set(state['curve_points'][0])
+    if basic_ids & curve_ids:
+        _fail('node %d is both a basic point and a curve point', min(basic_ids & curve_ids))
+    node_ids = basic_ids | curve_ids
+
+    state['plane'] = _readPlane(d['_plane'], '_plane')
+
+    _checkType(d['_curves'], dict, '_curves')
+    state['curves'] = {}
+    for key, curve in d['_curves'].items():
+        curve_identifier = _checkIdentifier(key, '_curves')
+        state['curves'][curve_identifier] = _readCurve(curve, curve_ids, '_curves ' + str(curve_identifier))
+
+    _checkType(d['_plane_attitude_store'], list, '_plane_attitude_store')
+    attitudes = [_readPlaneAttitude(data, '_plane_attitude_store entry') for data in d['_plane_attitude_store']]
+
+    _checkType(d['_nodes'], dict, '_nodes')
+    node_attitudes = {}
+    for key, index in d['_nodes'].items():
+        node_id = _checkIdentifier(key, '_nodes')
+        if node_id not in node_ids:
+            _fail('_nodes lists node %d that has no location', node_id)
+        _checkType(index, int, '_nodes attitude index')
+        if not 0 <= index < len(attitudes) or attitudes[index] is None:
+            _fail('node %d refers to the missing plane attitude %d', node_id, index)
+        node_attitudes[node_id] = index
+    if len(node_attitudes) != len(node_ids):
+        _fail('node %d has no plane attitude', min(node_ids - set(node_attitudes)))
+
+    used = set(node_attitudes.values())
+    state['attitudes'] = [attitude if index in used else None for index, attitude in enumerate(attitudes)]
+    state['node_attitudes'] = node_attitudes
+
+    selection = d.get('_selection', [])
+    _checkType(selection, list, '_selection')
+    state['selection'] = [node_id for node_id in (_checkIdentifier(value, '_selection') for value in selection) if node_id in node_ids]
+
+    return state
+
+
+def _readChangeRecord(record, name):
+    _checkType(record, dict, name)
+    for key in ['_attitudes', '_nodes', '_curves', '_plane']:
+        if key not in record:
+            _fail('%s %s is missing', name, key)
+
+    _checkType(record['_attitudes'], list, name + ' _attitudes')
+    attitudes = []
+    for data in record['_attitudes']:
+        if not isinstance(data, list) or len(data) != 2:
+            _fail('%s plane attitude must be a point and a normal', name)
+        attitudes.append((_checkVector(data[0], name + ' attitude point'), _checkVector(data[1], name + ' attitude normal')))
+
+    _checkType(record['_nodes'], dict, name + ' _nodes')
+    nodes = {}
+    for key, data in record['_nodes'].items():
+        node_id = _checkIdentifier(key, name + ' node')
+        if data is None:
+            nodes[node_id] = None
+            continue
+        if not isinstance(data, list) or len(data) != 3:
+            _fail('%s node %d must be a source, a location and an attitude index', name, node_id)
+        source, location, index = data
+        _checkType(source, int, name + ' node source')
+        if source not in _POINT_SOURCES:
+            _fail('%s node %d has the unknown source %r', name, node_id, source)
+        _checkType(index, int, name + ' attitude index')
+        if not 0 <= index < len(attitudes):
+            _fail('%s node %d refers to the missing plane attitude %d', name, node_id, index)
+        nodes[node_id] = (source, _checkVector(location, name + ' node location'), index)
+
+    _checkType(record['_curves'], dict, name + ' _curves')
+    curves = {}
+    for key, data in record['_curves'].items():
+        curve_identifier = _checkIdentifier(key, name + ' curve')
+        if data is None:
+            curves[curve_identifier] = None
+            continue
+        _checkType(data, str, name + ' curve')
+        try:
+            data = json.loads(data)
+        except ValueError as e:
+            _fail('%s curve %d: %s', name, curve_identifier, e)
+        curves[curve_identifier] = _readCurve(data, None, name + ' curve ' + str(curve_identifier))
+
+    return {'attitudes': attitudes,
+            'nodes': nodes,
+            'curves': curves,
+            'plane': _readPlane(record['_plane'], name + ' _plane')}
+
+
+def parseChangeRecords(curve_node_ids, curves, records):
+    '''
+    Parse and check change records from NodeModel.takeChanges before
+    any of them is applied.  The records are followed in order from the
+    given curve point identifiers and curves, a dict of curve identifier
+    to a dict with the '_nodes' of the curve, so every curve must only
+    list curve points.  Raises ValueError if a record is malformed or
+    inconsistent.
+    '''
+    curve_node_ids = set(curve_node_ids)
+    curve_nodes = dict((curve_identifier, list(curve['_nodes'])) for curve_identifier, curve in curves.items())
+    node_curves = {}
+    for curve_identifier, node_ids in curve_nodes.items():
+        for node_id in node_ids:
+            node_curves.setdefault(node_id, set()).add(curve_identifier)
+
+    parsed = []
+    for record_index, record in enumerate(records):
+        name = 'change record %d' % record_index
+        record = _readChangeRecord(record, name)
+        for node_id, data in record['nodes'].items():
+            if data is not None and data[0] == PointSource.CURVE_CONTROL:
+                curve_node_ids.add(node_id)
+            else:
+                curve_node_ids.discard(node_id)
+        for curve_identifier in record['curves']:
+            for node_id in curve_nodes.pop(curve_identifier, []):
+                node_curves[node_id].discard(curve_identifier)
+        for curve_identifier, curve in record['curves'].items():
+            if curve is None:
+                continue
+            for node_id in curve['_nodes']:
+                if node_id not in curve_node_ids:
+                    _fail('%s curve %d node %d is not a curve point', name, curve_identifier, node_id)
+                node_curves.setdefault(node_id, set()).add(curve_identifier)
+            curve_nodes[curve_identifier] = curve['_nodes']
+        for node_id in record['nodes']:
+            if node_id not in curve_node_ids and node_curves.get(node_id):
+                _fail('%s removes node %d of curve %d', name, node_id, min(node_curves[node_id]))
+        parsed.append(record)
+
+    return parsed
@@ -0,0 +1,177 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+from cmlibs.zinc.element import Elementbasis
+from cmlibs.zinc.graphics import Graphics
+from cmlibs.zinc.node import Node
+
+from mapclientplugins.segmentationstep.definitions import CURVE_GRAPHIC_NAME, CURVE_ON_PLANE_GRAPHIC_NAME
+from mapclientplugins.segmentationstep.zincutils import createFiniteElementField, create1DElementtemplate
+
+class CurveLineScene(object):
+    '''
+    Renders curves as line graphics over a 1D mesh in a child region
+    of the node model region.  Each curve is a chain of line elements
+    and is updated inside a single change to the region.  With a cubic
+    Hermite basis the nodes also store the derivative with respect to
+    the element parameter and Zinc tessellates the elements.
+    '''
+
+    def __init__(self, model, name, basis_function_type=Elementbasis.FUNCTION_TYPE_LINEAR_LAGRANGE, divisions=None):
+        self._model = model
+        self._region = model.getRegion().createChild(name)
+        self._coordinate_field = createFiniteElementField(self._region)
+        fieldmodule = self._region.getFieldmodule()
+        fieldmodule.beginChange()
+        scale_field = fieldmodule.createFieldAlias(model.getScaleField())
+        self._scaled_coordinate_field = self._coordinate_field * scale_field
+        self._on_plane_field = model.createOnPlaneConditionalField(self._region, self._scaled_coordinate_field)
+        self._nodeset = fieldmodule.findNodesetByName('nodes')
+        self._mesh = fieldmodule.findMeshByDimension(1)
+        self._node_template = self._nodeset.createNodetemplate()
+        self._node_template.defineField(self._coordinate_field)
+        self._hermite = basis_function_type == Elementbasis.FUNCTION_TYPE_CUBIC_HERMITE
+        if self._hermite:
+            self._node_template.setValueNumberOfVersions(self._coordinate_field, -1, Node.VALUE_LABEL_D_DS1, 1)
+        self._element_template = create1DElementtemplate(self._coordinate_field, basis_function_type)
+        fieldmodule.endChange()
+
+        self._curve_nodes = {}
+        self._curve_elements = {}
+        self._line_graphic = _createLineGraphics(self._region, self._scaled_coordinate_field, CURVE_GRAPHIC_NAME)
+        self._line_on_plane_graphic = _createLineGraphics(self._region, self._scaled_coordinate_field, CURVE_ON_PLANE_GRAPHIC_NAME, self._on_plane_field)
+        if divisions is not None:
+            _setLineDivisions(self._region, [self._line_graphic, self._line_on_plane_graphic], divisions)
+
+    def getRegion(self):
+        return self._region
+
+    def setCurve(self, curve_index, locations, derivatives=None, closed=False):
+        '''
+        Set the curve with the given index to pass through the given
+        locations.  Existing nodes and elements of the curve are reused
+        and only the surplus ones are destroyed.  The derivatives are
+        only used with a cubic Hermite basis, a closed curve gets an
+        extra element from the last location back to the first.
+        '''
+        fieldmodule = self._region.getFieldmodule()
+        fieldmodule.beginChange()
+        fieldcache = fieldmodule.createFieldcache()
+
+        nodes = self._curve_nodes[curve_index] if curve_index in self._curve_nodes else []
+        for index, location in enumerate(locations):
+            if index < len(nodes):
+                node = nodes[index]
+            else:
+                node = self._nodeset.createNode(-1, self._node_template)
+                nodes.append(node)
+            fieldcache.setNode(node)
+            self._coordinate_field.assignReal(fieldcache, location)
+            if self._hermite:
+                self._coordinate_field.setNodeParameters(fieldcache, -1, Node.VALUE_LABEL_D_DS1, 1, derivatives[index])
+
+        connectivity = [(index, index + 1) for index in range(len(locations) - 1)]
+        if closed and len(locations) > 2:
+            connectivity.append((len(locations) - 1, 0))
+        self._setElements(curve_index, nodes, connectivity)
+        self._destroyNodes(nodes[len(locations):])
+
+        self._curve_nodes[curve_index] = nodes[:len(locations)]
+        fieldmodule.endChange()
+
+    def _setElements(self, curve_index, nodes, connectivity):
+        '''
+        Elements are stored with the node indexes they connect, an
+        element is only recreated when its connectivity changes.
+        '''
+        elements = self._curve_elements[curve_index] if curve_index in self._curve_elements else []
+        for index, node_indexes in enumerate(connectivity):
+            if index < len(elements):
+                if elements[index][1] == node_indexes:
+                    continue
+                self._mesh.destroyElement(elements[index][0])
+
+            self._element_template.setNode(1, nodes[node_indexes[0]])
+            self._element_template.setNode(2, nodes[node_indexes[1]])
+            element = self._mesh.createElement(-1, self._element_template)
+            if index < len(elements):
+                elements[index] = (element, node_indexes)
+            else:
+                elements.append((element, node_indexes))
+
+        self._destroyElements(elements[len(connectivity):])
+        self._curve_elements[curve_index] = elements[:len(connectivity)]
+
+    def _destroyElements(self, elements):
+        for element, _ in elements:
+            self._mesh.destroyElement(element)
+
+    def _destroyNodes(self, nodes):
+        for node in nodes:
+            self._nodeset.destroyNode(node)
+
+    def clearCurve(self, curve_index):
+        fieldmodule = self._region.getFieldmodule()
+        fieldmodule.beginChange()
+        if curve_index in self._curve_elements:
+            self._destroyElements(self._curve_elements.pop(curve_index))
+        if curve_index in self._curve_nodes:
+            self._destroyNodes(self._curve_nodes.pop(curve_index))
+        fieldmodule.endChange()
+
+    def clearAllCurves(self):
+        fieldmodule = self._region.getFieldmodule()
+        fieldmodule.beginChange()
+        self._mesh.destroyAllElements()
+        self._nodeset.destroyAllNodes()
+        self._curve_elements = {}
+        self._curve_nodes = {}
+        fieldmodule.endChange()
+
+
+def _setLineDivisions(region, graphics, divisions):
+    scene = region.getScene()
+    scene.beginChange()
+    tessellationmodule = scene.getTessellationmodule()
+    tessellation = tessellationmodule.createTessellation()
+    tessellation.setMinimumDivisions([divisions])
+    for graphic in graphics:
+        graphic.setTessellation(tessellation)
+    scene.endChange()
+
+
+def _createLineGraphics(region, coordinate_field, name, subgroup_field=None):
+    scene = region.getScene()
+    scene.beginChange()
+
+    materialmodule = scene.getMaterialmodule()
+    blue_material = materialmodule.findMaterialByName('blue')
+
+    graphic = scene.createGraphicsLines()
+    graphic.setCoordinateField(coordinate_field)
+    graphic.setName(name)
+    graphic.setMaterial(blue_material)
+    graphic.setSelectMode(Graphics.SELECT_MODE_OFF)
+    if subgroup_field is not None:
+        graphic.setSubgroupField(subgroup_field)
+
+    scene.endChange()
+
+    return graphic
+
@@ -18,13 +18,21 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
 
+from concurrent.futures import ThreadPoolExecutor
+
+from cmlibs.zinc.element import Elementbasis
 from cmlibs.zinc.field import Field
 from cmlibs.zinc.glyph import Glyph
 from cmlibs.zinc.graphics import Graphics
 
 from mapclientplugins.segmentationstep.definitions import DEFAULT_SEGMENTATION_POINT_SIZE, POINT_CLOUD_GRAPHIC_NAME, \
     POINT_CLOUD_ON_PLANE_GRAPHIC_NAME, CURVE_GRAPHIC_NAME, CURVE_ON_PLANE_GRAPHIC_NAME, \
-    INTERPOLATION_POINT_GRAPHIC_NAME, INTERPOLATION_POINT_ON_PLANE_GRAPHIC_NAME
+    INTERPOLATION_POINT_GRAPHIC_NAME, INTERPOLATION_POINT_ON_PLANE_GRAPHIC_NAME, CurveRenderMode, \
+    DEFAULT_CURVE_ELEMENT_DIVISIONS, LevelOfDetail, DEFAULT_LOD_MEDIUM_NODE_COUNT, DEFAULT_LOD_LOW_NODE_COUNT, \
+    DEFAULT_LOD_MEDIUM_GLYPH_PIXELS, DEFAULT_LOD_LOW_GLYPH_PIXELS, DEFAULT_LOD_CIRCLE_DIVISIONS, DEFAULT_LOD_POINT_SIZE
+from mapclientplugins.segmentationstep.scene.curve import CurveLineScene
+from mapclientplugins.segmentationstep.zincutils import getGlyphSize
+from mapclientplugins.segmentationstep.instrumentation import timed
 
 class NodeScene(object):
 
@@ -32,6 +40,14 @@ class NodeScene(object):
         self._model = model
         self._curve_interpolation_graphics = {}
         self._curve_interpolation_on_plane_graphics = {}
+        self._curve_render_mode = CurveRenderMode.DATAPOINTS
+        self._curve_line_scenes = {}
+        self._level_of_detail = LevelOfDetail.HIGH
+        self._lod_medium_node_count = DEFAULT_LOD_MEDIUM_NODE_COUNT
+        self._lod_low_node_count = DEFAULT_LOD_LOW_NODE_COUNT
+        self._lod_medium_glyph_pixels = DEFAULT_LOD_MEDIUM_GLYPH_PIXELS
+        self._lod_low_glyph_pixels = DEFAULT_LOD_LOW_GLYPH_PIXELS
+        self._lod_tessellations = {}
         self._setupNodeVisualisation()
 
     def _setupNodeVisualisation(self):
@@ -41,8 +57,18 @@ class NodeScene(object):
         self._segmentation_point_on_plane_glyph = self._createPointCloudOnPlaneGraphics(region, coordinate_field)
         self._curve_point_glyph = self._createCurveGraphics(region, coordinate_field)
         self._curve_point_on_plane_glyph = self._createCurveOnPlaneGraphics(region, coordinate_field)
-        self._interpolation_point_glyph = _createInterpolationPointGraphics(region, coordinate_field)
+        self._interpolation_point_glyph = _createInterpolationPointGraphics(region, coordinate_field, self._model.getInterpolationPointGroupField())
         self._interpolation_point_on_plane_glyph = self._createInterpolationPointOnPlaneGraphics(region, coordinate_field)
+        self._setupLevelOfDetailTessellations(region)
+
+    def _setupLevelOfDetailTessellations(self, region):
+        scene = region.getScene()
+        tessellationmodule = scene.getTessellationmodule()
+        self._lod_tessellations[LevelOfDetail.HIGH] = self._segmentation_point_glyph.getTessellation()
+        coarse_tessellation = tessellationmodule.createTessellation()
+        coarse_tessellation.setCircleDivisions(DEFAULT_LOD_CIRCLE_DIVISIONS)
+        self._lod_tessellations[LevelOfDetail.MEDIUM] = coarse_tessellation
+        self._lod_tessellations[LevelOfDetail.LOW] = coarse_tessellation
 
     def _createPointCloudGraphics(self, region, finite_element_field):
         scene = region.getScene()
@@ -145,7 +171,7 @@ class NodeScene(object):
         graphic.setName(CURVE_ON_PLANE_GRAPHIC_NAME)
         graphic.setMaterial(blue_material)
         graphic.setSelectMode(Graphics.SELECT_MODE_OFF)
-        graphic.setSubgroupField(self._model.getOnPlaneSegmentationPointField())
+        graphic.setSubgroupField(self._model.getOnPlaneInterpolationField())
         attributes = graphic.getGraphicspointattributes()
         attributes.setGlyphShapeType(Glyph.SHAPE_TYPE_SPHERE)
         attributes.setBaseSize(DEFAULT_SEGMENTATION_POINT_SIZE)
@@ -154,6 +180,150 @@ class NodeScene(object):
 
         return graphic
 
+    def getLevelOfDetail(self):
+        return self._level_of_detail
+
+    def setLevelOfDetailNodeCounts(self, medium_node_count, low_node_count):
+        '''
+        Set the number of nodes above which the 3D glyphs are drawn
+        at the medium and the low level of detail.
+        '''
+        self._lod_medium_node_count = medium_node_count
+        self._lod_low_node_count = low_node_count
+
+    def setLevelOfDetailGlyphPixels(self, medium_glyph_pixels, low_glyph_pixels):
+        '''
+        Set the on screen glyph size in pixels below which the 3D glyphs
+        are drawn at the medium and the low level of detail.
+        '''
+        self._lod_medium_glyph_pixels = medium_glyph_pixels
+        self._lod_low_glyph_pixels = low_glyph_pixels
+
+    def calculateLevelOfDetail(self, node_count, pixels_per_unit=None):
+        glyph_pixels = None
+        if pixels_per_unit is not None:
+            glyph_pixels = getGlyphSize(self._segmentation_point_glyph)[0] * pixels_per_unit
+
+        if node_count > self._lod_low_node_count or (glyph_pixels is not None and glyph_pixels < self._lod_low_glyph_pixels):
+            return LevelOfDetail.LOW
+        if node_count > self._lod_medium_node_count or (glyph_pixels is not None and glyph_pixels < self._lod_medium_glyph_pixels):
+            return LevelOfDetail.MEDIUM
+
+        return LevelOfDetail.HIGH
+
+    def updateLevelOfDetail(self, node_count, pixels_per_unit=None):
+        '''
+        Choose the level of detail of the 3D glyphs from the number of
+        nodes and the number of pixels a unit length covers in the
+        viewport.  The graphics are only changed when the level changes.
+        '''
+        self.setLevelOfDetail(self.calculateLevelOfDetail(node_count, pixels_per_unit))
+
+    def setLevelOfDetail(self, level):
+        '''
+        At the high level of detail the 3D glyphs are spheres, at the
+        medium level they are spheres with fewer divisions and at the low
+        level they are drawn as points with a fixed size in pixels.
+        '''
+        if level == self._level_of_detail:
+            return
+
+        region = self._model.getRegion()
+        scene = region.getScene()
+        scene.beginChange()
+        shape_type = Glyph.SHAPE_TYPE_POINT if level == LevelOfDetail.LOW else Glyph.SHAPE_TYPE_SPHERE
+        for graphic in [self._segmentation_point_glyph, self._curve_point_glyph, self._interpolation_point_glyph]:
+            graphic.setTessellation(self._lod_tessellations[level])
+            graphic.setRenderPointSize(DEFAULT_LOD_POINT_SIZE)
+            attributes = graphic.getGraphicspointattributes()
+            attributes.setGlyphShapeType(shape_type)
+        scene.endChange()
+
+        self._level_of_detail = level
+
+    def getCurveRenderMode(self):
+        return self._curve_render_mode
+
+    def setCurveRenderMode(self, mode):
+        '''
+        Switch between showing the interpolation points of the curves
+        as datapoint glyphs, showing each curve as a polyline through
+        its interpolation points and showing each curve as cubic Hermite
+        elements through its control points.  All the curves of the
+        model are redrawn in the new mode.
+        '''
+        if mode == self._curve_render_mode:
+            return
+
+        region = self._model.getRegion()
+        region.beginHierarchicalChange()
+        self.clearAllInterpolationPoints()
+        self._curve_render_mode = mode
+        self.updateCurves(dict((curve_index, self._model.getCurveWithIdentifier(curve_index)) for curve_index in self._model.getCurveIdentifiers()))
+        region.endHierarchicalChange()
+
+    def _getCurveLineScene(self, mode):
+        if mode not in self._curve_line_scenes:
+            if mode == CurveRenderMode.HERMITE:
+                line_scene = CurveLineScene(self._model, 'curve_elements', Elementbasis.FUNCTION_TYPE_CUBIC_HERMITE, DEFAULT_CURVE_ELEMENT_DIVISIONS)
+            else:
+                line_scene = CurveLineScene(self._model, 'curve_polylines')
+            self._curve_line_scenes[mode] = line_scene
+
+        return self._curve_line_scenes[mode]
+
+    def updateCurve(self, curve_index, curve):
+        '''
+        Show the given curve in the current curve render mode,
+        a curve with fewer than two nodes has nothing to show.
+        '''
+        if len(curve) > 1:
+            self._showCurve(curve_index, curve, self._calculateCurve(curve))
+        else:
+            self.clearInterpolationPoints(curve_index)
+
+    @timed('NodeScene.updateCurves')
+    def updateCurves(self, curves, max_workers=None):
+        '''
+        Show all the given curves, a dict of curve index to curve, in
+        the current curve render mode.  The control point locations are
+        read on this thread, the splines are fitted and sampled in a pool
+        of worker threads and the results are shown in a single change.
+        '''
+        shown = [(curve_index, curve) for curve_index, curve in curves.items() if len(curve) > 1]
+        for _, curve in shown:
+            curve.loadControlPoints()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(self._calculateCurve, [curve for _, curve in shown]))
+
+        region = self._model.getRegion()
+        region.beginHierarchicalChange()
+        for (curve_index, curve), result in zip(shown, results):
+            self._showCurve(curve_index, curve, result)
+        for curve_index, curve in curves.items():
+            if len(curve) <= 1:
+                self.clearInterpolationPoints(curve_index)
+        region.endHierarchicalChange()
+
+    def _calculateCurve(self, curve):
+        if self._curve_render_mode == CurveRenderMode.HERMITE:
+            return curve.calculateHermite()
+        elif self._curve_render_mode == CurveRenderMode.POLYLINE:
+            return curve.calculatePolyline()
+
+        return curve.calculate()
+
+    def _showCurve(self, curve_index, curve, result):
+        if self._curve_render_mode == CurveRenderMode.HERMITE:
+            locations, derivatives = result
+            self._getCurveLineScene(CurveRenderMode.HERMITE).setCurve(curve_index, locations, derivatives, curve.isClosed())
+        elif self._curve_render_mode == CurveRenderMode.POLYLINE:
+            self._getCurveLineScene(CurveRenderMode.POLYLINE).setCurve(curve_index, result)
+        else:
+            self.setInterpolationPoints(curve_index, result)
+
+    @timed('NodeScene.setInterpolationPoints')
     def setInterpolationPoints(self, curve_index, locations):
         region = self._model.getRegion()
         scene = region.getScene()
@@ -163,10 +333,10 @@ class NodeScene(object):
         index = 0
         for location in locations:
             if index >= len(glyphs):
-                glyph = self._model.createDatapoint(location)
+                glyph = self._model.acquireDatapoint(location)
                 glyphs.append(glyph)
             else:
-                self._model.setNodeLocation(glyphs[index], location)
+                self._model.setDatapointLocation(glyphs[index], location)
 
             index += 1
 
@@ -182,18 +352,21 @@ class NodeScene(object):
             self._removeGlyphs(self._curve_interpolation_graphics[curve_index])
 
         self._curve_interpolation_graphics = {}
+        for line_scene in self._curve_line_scenes.values():
+            line_scene.clearAllCurves()
 
     def clearInterpolationPoints(self, curve_index):
         if curve_index in self._curve_interpolation_graphics:
             self._removeGlyphs(self._curve_interpolation_graphics[curve_index])
             self._curve_interpolation_graphics.pop(curve_index)
+        for line_scene in self._curve_line_scenes.values():
+            line_scene.clearCurve(curve_index)
 
     def _removeGlyphs(self, glyphs):
         region = self._model.getRegion()
         scene = region.getScene()
         scene.beginChange()
-        for glyph in glyphs:
-            self._model.removeDatapoint(glyph)
+        self._model.releaseDatapoints(glyphs)
         scene.endChange()
 
     def getGraphic(self, name):
@@ -214,7 +387,7 @@ class NodeScene(object):
         return graphic
 
 
-def _createInterpolationPointGraphics(region, finite_element_field):
+def _createInterpolationPointGraphics(region, finite_element_field, subgroup_field):
     scene = region.getScene()
     scene.beginChange()
 
@@ -227,7 +400,7 @@ def _createInterpolationPointGraphics(region, finite_element_field):
     graphic.setName(CURVE_GRAPHIC_NAME)
     graphic.setMaterial(blue_material)
     graphic.setSelectMode(Graphics.SELECT_MODE_OFF)
-#         graphic.setSubgroupField(self._model.getOnPlaneSegmentationPointField())
+    graphic.setSubgroupField(subgroup_field)
     attributes = graphic.getGraphicspointattributes()
     attributes.setGlyphShapeType(Glyph.SHAPE_TYPE_SPHERE)
     attributes.setBaseSize(DEFAULT_SEGMENTATION_POINT_SIZE)
@@ -84,7 +84,7 @@ class SegmentationStep(WorkflowStepMountPoint):
         self._dataIn = dataIn
 
     def getPortData(self, portId):
-        return self._model.getPointCloud()
+        return self._model.getPointCloudArray()
 
     def execute(self):
         if self._view is None:
@@ -100,6 +100,21 @@ class CurveTool(SegmentationTool):
         self._handlers[ViewType.VIEW_2D].setInterpolationCount(value)
         self._handlers[ViewType.VIEW_3D].setInterpolationCount(value)
 
+    def setSamplingMode(self, mode):
+        '''
+        Set the sampling mode for new curves, see CurveModel.setSamplingMode.
+        '''
+        self._handlers[ViewType.VIEW_2D].setSamplingMode(mode)
+        self._handlers[ViewType.VIEW_3D].setSamplingMode(mode)
+
+    def setSampleSpacing(self, spacing):
+        self._handlers[ViewType.VIEW_2D].setSampleSpacing(spacing)
+        self._handlers[ViewType.VIEW_3D].setSampleSpacing(spacing)
+
+    def setSampleTolerance(self, tolerance):
+        self._handlers[ViewType.VIEW_2D].setSampleTolerance(tolerance)
+        self._handlers[ViewType.VIEW_3D].setSampleTolerance(tolerance)
+
     def _filterNodes(self, node_ids):
         curve_nodes = []
         group = self._model.getCurveGroup()
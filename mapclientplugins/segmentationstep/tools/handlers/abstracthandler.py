@@ -19,7 +19,7 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
 '''
 from PySide6 import QtCore
 
-from mapclientplugins.segmentationstep.zincutils import button_map, modifier_map, Sceneviewerinput
+from mapclientplugins.segmentationstep.zincutils import Sceneviewerinput
 from mapclientplugins.segmentationstep.undoredo import CommandChangeView
 from mapclientplugins.segmentationstep.definitions import \
     IMAGE_PLANE_GRAPHIC_NAME, POINT_CLOUD_GRAPHIC_NAME, \
@@ -28,6 +28,23 @@ from mapclientplugins.segmentationstep.definitions import \
     PLANE_MANIPULATION_SPHERE_GRAPHIC_NAME, \
     PLANE_MANIPULATION_NORMAL_GRAPHIC_NAME
 
+button_map = {
+    QtCore.Qt.MouseButton.LeftButton: Sceneviewerinput.BUTTON_TYPE_LEFT,
+    QtCore.Qt.MouseButton.MiddleButton: Sceneviewerinput.BUTTON_TYPE_MIDDLE,
+    QtCore.Qt.MouseButton.RightButton: Sceneviewerinput.BUTTON_TYPE_RIGHT
+}
+# Create a modifier map of Qt modifier keys to Zinc modifier keys
+def modifier_map(qt_modifiers):
+    '''
+    Return a Zinc SceneViewerInput modifiers object that is created from
+    the Qt modifier flags passed in.
+    '''
+    modifiers = Sceneviewerinput.MODIFIER_FLAG_NONE
+    if qt_modifiers & QtCore.Qt.KeyboardModifier.ShiftModifier:
+        modifiers = modifiers | Sceneviewerinput.MODIFIER_FLAG_SHIFT
+
+    return modifiers
+
 
 class AbstractHandler(object):
 
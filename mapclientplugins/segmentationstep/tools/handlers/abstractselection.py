@@ -49,8 +49,6 @@ class AbstractSelection(AbstractHandler):
             self._selection_mode = SelectionMode.EXCULSIVE
             if event.modifiers() & QtCore.Qt.KeyboardModifier.AltModifier:
                 self._selection_mode = SelectionMode.ADDITIVE
-
-            self._start_selection = self._model.getCurrentSelection()
         else:
             super(AbstractSelection, self).mousePressEvent(event)
 
@@ -85,7 +83,9 @@ class AbstractSelection(AbstractHandler):
             region = self._model.getRegion()
             region.beginHierarchicalChange()
             self._selection_box.setVisibilityFlag(False)
-            selection_group = self._model.getSelectionGroupField()
+            self._model.clearPickGroup()
+            exclusive = self._selection_mode == SelectionMode.EXCULSIVE
+            toggle = False
 
             if x != self._selection_position_start[0] and y != self._selection_position_start[1]:
                 left = min(x, self._selection_position_start[0])
@@ -93,29 +93,18 @@ class AbstractSelection(AbstractHandler):
                 bottom = min(y, self._selection_position_start[1])
                 top = max(y, self._selection_position_start[1])
                 self._zinc_view.setPickingRectangle(COORDINATE_SYSTEM_LOCAL, left, bottom, right, top)
-                if self._selection_mode == SelectionMode.EXCULSIVE:
-                    selection_group.clear()
-                self._zinc_view.addPickedNodesToFieldGroup(selection_group)
+                self._zinc_view.addPickedNodesToFieldGroup(self._model.getPickGroupField())
             else:
                 node = self._zinc_view.getNearestNode(x, y)
-                if self._selection_mode == SelectionMode.EXCULSIVE and not node.isValid():
-                    selection_group.clear()
-
                 if node.isValid():
                     group = self._model.getSelectionGroup()
-                    if self._selection_mode == SelectionMode.EXCULSIVE:
-                        remove_current = group.getSize() == 1 and group.containsNode(node)
-                        selection_group.clear()
-                        if not remove_current:
-                            group.addNode(node)
-                    elif self._selection_mode == SelectionMode.ADDITIVE:
-                        if group.containsNode(node):
-                            group.removeNode(node)
-                        else:
-                            group.addNode(node)
+                    remove_current = exclusive and group.getSize() == 1 and group.containsNode(node)
+                    if not remove_current:
+                        self._model.getPickGroup().addNode(node)
+                    toggle = not exclusive
 
-            end_selection = self._model.getCurrentSelection()
-            c = CommandSelection(self._model, self._start_selection, end_selection)
+            added, removed = self._model.calculateSelectionDelta(exclusive, toggle)
+            c = CommandSelection(self._model, added, removed)
             self._undo_redo_stack.push(c)
             region.endHierarchicalChange()
             self._selection_mode = SelectionMode.NONE
@@ -20,7 +20,8 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
 from PySide6 import QtCore
 
 from mapclientplugins.segmentationstep.tools.handlers.abstractselection import AbstractSelection
-from mapclientplugins.segmentationstep.definitions import ViewMode, DEFAULT_INTERPOLATION_COUNT
+from mapclientplugins.segmentationstep.definitions import ViewMode, DEFAULT_INTERPOLATION_COUNT, SamplingMode, \
+    DEFAULT_SAMPLE_SPACING, DEFAULT_SAMPLE_TOLERANCE
 from mapclientplugins.segmentationstep.undoredo import CommandCurveNode, CommandMovePlane
 from mapclientplugins.segmentationstep.segmentpoint import ControlPointStatus
 from mapclientplugins.segmentationstep.maths.algorithms import calculateLinePlaneIntersection
@@ -36,6 +37,9 @@ class Curve(AbstractSelection):
         self._node_status = None
         self._active_curve = None
         self._interpolation_count = DEFAULT_INTERPOLATION_COUNT
+        self._sampling_mode = SamplingMode.PARAMETRIC
+        self._sample_spacing = DEFAULT_SAMPLE_SPACING
+        self._sample_tolerance = DEFAULT_SAMPLE_TOLERANCE
 
     def setModel(self, model):
         self._model = model
@@ -46,6 +50,15 @@ class Curve(AbstractSelection):
     def setInterpolationCount(self, count):
         self._interpolation_count = count
 
+    def setSamplingMode(self, mode):
+        self._sampling_mode = mode
+
+    def setSampleSpacing(self, spacing):
+        self._sample_spacing = spacing
+
+    def setSampleTolerance(self, tolerance):
+        self._sample_tolerance = tolerance
+
     def enter(self):
         super(Curve, self).enter()
 
@@ -70,11 +83,7 @@ class Curve(AbstractSelection):
                 node_id = self._node_status.getNodeIdentifier()
                 self._active_curve.removeNode(node_id)
                 curve_index = self._model.getCurveIdentifier(self._active_curve)
-                if len(self._active_curve) > 1:
-                    locations = self._active_curve.calculate()
-                    self._scene.setInterpolationPoints(curve_index, locations)
-                else:
-                    self._scene.clearInterpolationPoints(curve_index)
+                self._scene.updateCurve(curve_index, self._active_curve)
 
                 self._model.removeNode(node_id)
                 self._node_status = None
@@ -109,6 +118,9 @@ class Curve(AbstractSelection):
                 self._active_curve = CurveModel(self._model)
                 self._model.insertCurve(self._model.getNextCurveIdentifier(), self._active_curve)
                 self._active_curve.setInterpolationCount(self._interpolation_count)
+                self._active_curve.setSamplingMode(self._sampling_mode)
+                self._active_curve.setSampleSpacing(self._sample_spacing)
+                self._active_curve.setSampleTolerance(self._sample_tolerance)
                 node_location = None
                 plane_attitude = None
                 point_on_plane = self._calculatePointOnPlane(x, y)
@@ -141,9 +153,7 @@ class Curve(AbstractSelection):
             point_on_plane = self._calculatePointOnPlane(x, y)
             self._model.setNodeLocation(node, point_on_plane)
             curve_index = self._model.getCurveIdentifier(self._active_curve)
-            if len(self._active_curve) > 1:
-                locations = self._active_curve.calculate()
-                self._scene.setInterpolationPoints(curve_index, locations)
+            self._scene.updateCurve(curve_index, self._active_curve)
             if self._modifying_curve:
                 pass
             elif not self._adding_to_curve or not self._finshing_curve:
@@ -190,8 +200,7 @@ class Curve(AbstractSelection):
             node_status.setCurveIdentifier(curve_index)
             self._node_status.setCurveIdentifier(curve_index)
             self._undo_redo_stack.push(c)
-            locations = self._active_curve.calculate()
-            self._scene.setInterpolationPoints(curve_index, locations)
+            self._scene.updateCurve(curve_index, self._active_curve)
             self._node_status = ControlPointStatus(node_id, None, None)
             self._node_status.setCurveIdentifier(curve_index)
 
@@ -22,6 +22,19 @@ from PySide6 import QtGui
 from mapclientplugins.segmentationstep.plane import PlaneAttitude
 from mapclientplugins.segmentationstep.maths.vectorops import mult, add
 from mapclientplugins.segmentationstep.model.curve import CurveModel
+from mapclientplugins.segmentationstep.model.identifierset import IdentifierSet
+from mapclientplugins.segmentationstep.instrumentation import measure
+
+
+class UndoRedoStack(QtGui.QUndoStack):
+    '''
+    Undo redo stack that records the time taken to push a command,
+    pushing a command also executes its redo method.
+    '''
+
+    def push(self, command):
+        with measure('QUndoStack.push'):
+            super(UndoRedoStack, self).push(command)
 
 
 class CommandMovePlane(QtGui.QUndoCommand):
@@ -286,11 +299,7 @@ class CommandCurveNode(CommandNode):
 
     def _updateInterpolationPoints(self, curve):
         curve_index = self._model.getCurveIdentifier(curve)
-        if len(curve) > 1:
-            locations = curve.calculate()
-            self._scene.setInterpolationPoints(curve_index, locations)
-        else:
-            self._scene.clearInterpolationPoints(curve_index)
+        self._scene.updateCurve(curve_index, curve)
 
     def _removeCurve(self, curve_id):
         self._model.popCurve(curve_id)
@@ -361,18 +370,18 @@ class CommandCurveNode(CommandNode):
 
 class CommandSelection(QtGui.QUndoCommand):
 
-    def __init__(self, model, selection_start, selection_end):
+    def __init__(self, model, added, removed):
         super(CommandSelection, self).__init__()
         self.setText('Selection')
         self._model = model
-        self._selection_start = selection_start
-        self._selection_end = selection_end
+        self._added = IdentifierSet(added)
+        self._removed = IdentifierSet(removed)
 
     def redo(self):
-        self._model.setSelection(self._selection_end)
+        self._model.applySelectionDelta(self._added, self._removed)
 
     def undo(self):
-        self._model.setSelection(self._selection_start)
+        self._model.applySelectionDelta(self._removed, self._added)
 
 
 class CommandDelete(QtGui.QUndoCommand):
@@ -413,7 +422,7 @@ class CommandDeleteCurve(QtGui.QUndoCommand):
         self._model = model
         self._node_statuses = {}
         self._curves = {}
-        self._interpolation_counts = {}
+        self._sampling_settings = {}
         self._selected = selected
         self._scene = None
         different_curves = []
@@ -423,7 +432,7 @@ class CommandDeleteCurve(QtGui.QUndoCommand):
             if curve_identifier not in different_curves:
                 different_curves.append(curve_identifier)
                 self._curves[curve_identifier] = curve
-                self._interpolation_counts[curve_identifier] = curve.getInterpolationCount()
+                self._sampling_settings[curve_identifier] = curve.getSamplingSettings()
                 self._node_statuses[curve_identifier] = []
                 for curve_node_id in curve.getNodes():
                     self._node_statuses[curve_identifier].append(model.getNodeStatus(curve_node_id))
@@ -452,13 +461,11 @@ class CommandDeleteCurve(QtGui.QUndoCommand):
             if self._curves[curve_identifier] is None:
                 curve = CurveModel(self._model)
                 self._model.insertCurve(curve_identifier, curve)
-                curve.setInterpolationCount(self._interpolation_counts[curve_identifier])
+                curve.setSamplingSettings(self._sampling_settings[curve_identifier])
                 node_ids = self._model.createNodes(self._node_statuses[curve_identifier], group=self._model.getCurveGroup())
                 curve.setNodes(node_ids)
                 self._curves[curve_identifier] = curve
-                if len(curve) > 1:
-                    locations = curve.calculate()
-                    self._scene.setInterpolationPoints(curve_identifier, locations)
+                self._scene.updateCurve(curve_identifier, curve)
 
         self._model.setSelection(self._selected)
 
@@ -552,7 +559,7 @@ class CommandPushPullCurve(AbstractCommandPushPull):
         self._scene = None
         self._node_statuses = {}
         self._curves = {}
-        self._interpolation_counts = {}
+        self._sampling_settings = {}
         different_curves = []
         for node_id in selected:
             curve = self._model.getCurveForNode(node_id)
@@ -560,7 +567,7 @@ class CommandPushPullCurve(AbstractCommandPushPull):
             if curve_identifier not in different_curves:
                 different_curves.append(curve_identifier)
                 self._curves[curve_identifier] = curve_identifier
-                self._interpolation_counts[curve_identifier] = curve.getInterpolationCount()
+                self._sampling_settings[curve_identifier] = curve.getSamplingSettings()
                 self._node_statuses[curve_identifier] = self._adjustNodeLocation(curve.getNodes(), scale)
 
     def setScene(self, scene):
@@ -579,12 +586,10 @@ class CommandPushPullCurve(AbstractCommandPushPull):
             curve = CurveModel(self._model)
             next_curve_identifier = self._model.getNextCurveIdentifier()
             self._model.insertCurve(next_curve_identifier, curve)
-            curve.setInterpolationCount(self._interpolation_counts[curve_identifier])
+            curve.setSamplingSettings(self._sampling_settings[curve_identifier])
             curve.setNodes(node_ids)
             self._curves[curve_identifier] = next_curve_identifier
-            if len(curve) > 1:
-                locations = curve.calculate()
-                self._scene.setInterpolationPoints(next_curve_identifier, locations)
+            self._scene.updateCurve(next_curve_identifier, curve)
             selection_node_ids += node_ids
 
         self._model.setSelection(selection_node_ids)
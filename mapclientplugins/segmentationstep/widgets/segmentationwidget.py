@@ -28,7 +28,15 @@ from mapclientplugins.segmentationstep.widgets.segmentationstate import Segmenta
 from mapclientplugins.segmentationstep.zincutils import getGlyphSize, setGlyphSize
 from mapclientplugins.segmentationstep.widgets.sceneviewertab import SceneviewerTab
 from mapclientplugins.segmentationstep.scene.master import MasterScene
+from mapclientplugins.segmentationstep.instrumentation import recorder
+from mapclientplugins.segmentationstep.definitions import DEFAULT_LATENCY_REFRESH_INTERVAL, DEFAULT_AUTOSAVE_INTERVAL, \
+    DEFAULT_AUTOSAVE_JOURNAL_LIMIT
+from mapclientplugins.segmentationstep.autosave import Autosave, DeltaSave, readJournal, readGeneration
+from mapclientplugins.segmentationstep.model.node import encodeSnapshot
 import os
+import logging
+
+logger = logging.getLogger(__name__)
 
 class SegmentationWidget(QtWidgets.QWidget):
     """
@@ -50,11 +58,24 @@ class SegmentationWidget(QtWidgets.QWidget):
         self._model = model
         self._scene = MasterScene(self._model)
         self._serialization_location = None
+        self._delta_save = None
+        self._delta_save_enabled = True
+        self._autosave = None
+        self._autosave_changes = self._model.getNodeModel().createChangeTracker()
+        self._autosave_active = False
+        self._autosave_base = False
+        self._autosave_dirty = False
+        self._autosave_journal_count = 0
+        self._autosave_timer = QtCore.QTimer(self)
+        self._autosave_timer.setInterval(DEFAULT_AUTOSAVE_INTERVAL)
+        self._autosave_timer.timeout.connect(self._autosaveState)
 
         self._setupTabs()
         self._setupTools()
 
         self._debug_print = False
+        self._latency_label = None
+        self._latency_timer = None
 
         self._viewstate = None
 
@@ -74,6 +95,10 @@ class SegmentationWidget(QtWidgets.QWidget):
         self._ui._pushButtonSave.clicked.connect(self._saveState)
         self._ui._pushButtonLoad.clicked.connect(self._loadState)
 
+        self._tabs[ViewType.VIEW_3D].getZincWidget().viewportChanged.connect(self._updateLevelOfDetail)
+        self._model.getUndoRedoStack().indexChanged.connect(self._updateLevelOfDetail)
+        self._model.getUndoRedoStack().indexChanged.connect(self._journalChanges)
+
     def _setupUi(self):
         dbl_validator = QtGui.QDoubleValidator()
         dbl_validator.setBottom(0.0)
@@ -106,6 +131,18 @@ class SegmentationWidget(QtWidgets.QWidget):
 
     def setSerializationLocation(self, location):
         self._serialization_location = location
+        if self._delta_save is not None:
+            self._delta_save.close()
+        self._delta_save = DeltaSave(self._model.getNodeModel(), self._getNodeFilename())
+        if self._autosave is not None:
+            self._autosave.stop()
+        self._autosave = Autosave(os.path.join(location, 'node_state.autosave.json'),
+                                  os.path.join(location, 'node_state.journal'), encodeSnapshot)
+        # Leave the files of an earlier session alone until they have
+        # been recovered by loading or replaced by saving.
+        self._autosave_active = not self._autosave.hasRecoveryFiles()
+        self._autosave_base = False
+        self._autosave_timer.start()
 
     def _resetViewClicked(self):
         self._loadViewState()
@@ -114,35 +151,123 @@ class SegmentationWidget(QtWidgets.QWidget):
     def _getNodeFilename(self):
         return os.path.join(self._serialization_location, 'node_state.json')
 
+    def isDeltaSaveEnabled(self):
+        return self._delta_save_enabled
+
+    def setDeltaSaveEnabled(self, enabled):
+        '''
+        In delta save mode a save appends the changes since the previous
+        save to the saved state instead of rewriting all of it.
+        '''
+        self._delta_save_enabled = enabled
+
     def _saveState(self):
-        node_model = self._model.getNodeModel()
-        str_model = node_model.serialize()
         node_filename = self._getNodeFilename()
         try:
             if not os.path.exists(self._serialization_location):
                 os.makedirs(self._serialization_location)
-            with open(node_filename, 'w') as f:
-                f.write(str_model)
+            if self._delta_save_enabled:
+                self._delta_save.save()
+            else:
+                self._delta_save.compact()
         except IOError:
-            pass
+            logger.exception('Failed to save the segmentation to %s', node_filename)
+            return
+
+        self._autosave_changes.clear()
+        if self._autosave is not None:
+            self._autosave.discard()
+            self._autosave_active = True
+            self._autosave_base = False
+            self._autosave_dirty = False
 
     def _loadState(self):
         node_model = self._model.getNodeModel()
-        node_filename = self._getNodeFilename()
+        loaded = False
         try:
-            with open(node_filename, 'r') as f:
-    #         f = open(node_filename, 'r')
-                str_model = f.read()
-                node_model.deserialize(str_model)
-                node_scene = self._scene.getNodeScene()
-                node_scene.clearAllInterpolationPoints()
-                for curve_identifier in node_model.getCurveIdentifiers():
-                    curve = node_model.getCurveWithIdentifier(curve_identifier)
-                    if len(curve) > 1:
-                        locations = curve.calculate()
-                        node_scene.setInterpolationPoints(curve_identifier, locations)
+            self._delta_save.load()
+            loaded = True
+            logger.info('Loaded %s: %s', self._getNodeFilename(), node_model.getLoadStatistics())
         except IOError:
             pass
+        except ValueError:
+            logger.exception('Failed to load the segmentation from %s', self._getNodeFilename())
+
+        if self._recoverAutosave() or loaded:
+            node_scene = self._scene.getNodeScene()
+            node_scene.clearAllInterpolationPoints()
+            node_scene.updateCurves(dict((curve_identifier, node_model.getCurveWithIdentifier(curve_identifier)) for curve_identifier in node_model.getCurveIdentifiers()))
+            self._updateLevelOfDetail()
+
+    def _recoverAutosave(self):
+        '''
+        Load the autosaved snapshot and replay the journal of changes
+        made after it, both are newer than the saved state.  Returns True
+        if anything was recovered.
+        '''
+        if self._autosave is None:
+            return False
+
+        self._autosave.flush()
+        node_model = self._model.getNodeModel()
+        recovered = False
+        try:
+            with open(self._autosave.getFilename(), 'r') as f:
+                text = f.read()
+            node_model.deserialize(text, readJournal(self._autosave.getJournalFilename(), readGeneration(text)))
+            recovered = True
+        except IOError:
+            pass
+        except ValueError:
+            logger.exception('Failed to recover the autosaved segmentation from %s', self._autosave.getFilename())
+
+        self._autosave_changes.clear()
+        self._autosave_active = True
+        self._autosave_base = False
+        self._autosave_dirty = False
+        if recovered:
+            self._delta_save.reset()
+            self._autosaveState()
+
+        return recovered
+
+    def _autosaveState(self):
+        '''
+        Take a snapshot of the node model on this thread and leave the
+        encoding and writing of it to the autosave worker thread.  A
+        snapshot is only taken if the model changed since the last one.
+        '''
+        node_model = self._model.getNodeModel()
+        if not self._autosave_active or (self._autosave_base and not self._autosave_dirty and not self._autosave_changes.hasChanges()):
+            return
+
+        snapshot = node_model.snapshot()
+        self._autosave_changes.clear()
+        self._autosave.saveSnapshot(snapshot)
+        self._autosave_base = True
+        self._autosave_dirty = False
+        self._autosave_journal_count = 0
+
+    def _journalChanges(self):
+        '''
+        Append the changes made by the latest undo stack command to the
+        autosave journal, the first change needs a snapshot to apply to.
+        A full journal is replaced by a new snapshot.
+        '''
+        if not self._autosave_active or not self._autosave_changes.hasChanges():
+            return
+
+        if not self._autosave_base or self._autosave_journal_count >= DEFAULT_AUTOSAVE_JOURNAL_LIMIT:
+            self._autosaveState()
+        else:
+            self._autosave.appendJournal(self._model.getNodeModel().takeChanges(self._autosave_changes))
+            self._autosave_dirty = True
+            self._autosave_journal_count += 1
+
+    def _updateLevelOfDetail(self):
+        node_count = self._model.getNodeModel().getNodeCount()
+        pixels_per_unit = self._tabs[ViewType.VIEW_3D].getZincWidget().getPixelsPerUnit()
+        self._scene.getNodeScene().updateLevelOfDetail(node_count, pixels_per_unit)
 
     def _saveViewState(self):
         eye, lookat, up, angle = self._ui._sceneviewer3d.getViewParameters()
@@ -250,6 +375,57 @@ class SegmentationWidget(QtWidgets.QWidget):
     def keyPressEvent(self, keyevent):
         if keyevent.key() == 68 and not self._debug_print:
             self._debug_print = True
+        elif self._debug_print and keyevent.key() == QtCore.Qt.Key_L and not keyevent.isAutoRepeat():
+            self._toggleLatencyDisplay()
+        elif self._debug_print and keyevent.key() == QtCore.Qt.Key_E and not keyevent.isAutoRepeat():
+            self._exportLatency()
+
+    def _toggleLatencyDisplay(self):
+        '''
+        Hidden debug display, hold 'D' and press 'L' to start recording
+        timings and show the p50 and p99 durations, press again to stop.
+        '''
+        enabled = not recorder.isEnabled()
+        recorder.setEnabled(enabled)
+        if enabled:
+            self._latency_label = QtWidgets.QLabel(self)
+            self._latency_label.setStyleSheet('background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace;')
+            self._latency_label.show()
+            self._latency_timer = QtCore.QTimer(self)
+            self._latency_timer.setInterval(DEFAULT_LATENCY_REFRESH_INTERVAL)
+            self._latency_timer.timeout.connect(self._updateLatencyDisplay)
+            self._updateLatencyDisplay()
+            self._latency_timer.start()
+        elif self._latency_label is not None:
+            self._latency_timer.stop()
+            self._latency_timer.deleteLater()
+            self._latency_label.deleteLater()
+            self._latency_timer = None
+            self._latency_label = None
+
+    def _updateLatencyDisplay(self):
+        lines = ['%-50s %8s %8s %6s' % ('', 'p50 ms', 'p99 ms', 'n')]
+        summary = recorder.summary()
+        for name in summary:
+            lines.append('%-50s %8.2f %8.2f %6d' % (name, summary[name]['p50'] * 1000.0, summary[name]['p99'] * 1000.0, summary[name]['count']))
+        self._latency_label.setText('\n'.join(lines))
+        self._latency_label.adjustSize()
+        self._latency_label.raise_()
+
+    def _exportLatency(self):
+        '''
+        Hidden debug export, hold 'D' and press 'E' to write the
+        recorded timings to the serialization location.
+        '''
+        if self._serialization_location is None:
+            return
+
+        try:
+            if not os.path.exists(self._serialization_location):
+                os.makedirs(self._serialization_location)
+            recorder.exportJSON(os.path.join(self._serialization_location, 'latency.json'))
+        except IOError:
+            pass
 
     def _changeHandler(self, handler_type):
         undo_redo_stack = self._model.getUndoRedoStack()
@@ -294,9 +470,11 @@ class SegmentationWidget(QtWidgets.QWidget):
         context = self._model.getContext()
 
         view3d = SceneviewerTab(context, self._model.getUndoRedoStack())
+        view3d.getZincWidget().setViewName(ViewType.VIEW_3D)
         self._ui._tabWidgetLeft.addTab(view3d, ViewType.VIEW_3D)
 
         view2d = SceneviewerTab(context, self._model.getUndoRedoStack())
+        view2d.getZincWidget().setViewName(ViewType.VIEW_2D)
         view2d.setPlane(self._model.getImageModel().getPlane())
         self._ui._tabWidgetLeft.addTab(view2d, ViewType.VIEW_2D)
 
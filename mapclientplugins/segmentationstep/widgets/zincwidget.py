@@ -17,6 +17,8 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     You should have received a copy of the GNU General Public License
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 """
+from math import sqrt
+
 from PySide6 import QtCore, QtOpenGLWidgets
 
 from cmlibs.zinc.sceneviewer import Sceneviewer, Sceneviewerevent
@@ -26,6 +28,8 @@ from cmlibs.zinc.field import Field
 from cmlibs.zinc.glyph import Glyph
 from cmlibs.zinc.status import OK
 
+from mapclientplugins.segmentationstep.instrumentation import measure
+
 # mapping from qt to zinc start
 # Create a button map of Qt mouse buttons to Zinc input buttons
 button_map = {QtCore.Qt.LeftButton: Sceneviewerinput.BUTTON_TYPE_LEFT, QtCore.Qt.MiddleButton: Sceneviewerinput.BUTTON_TYPE_MIDDLE, QtCore.Qt.RightButton: Sceneviewerinput.BUTTON_TYPE_RIGHT}
@@ -65,6 +69,8 @@ class ZincWidget(QtOpenGLWidgets.QOpenGLWidget):
 
     # Create a signal to notify when the sceneviewer is ready.
     graphicsInitialized = QtCore.Signal()
+    # Create a signal to notify when the viewport size or the view transformation changes.
+    viewportChanged = QtCore.Signal()
 
     # init start
     def __init__(self, parent=None):
@@ -88,6 +94,8 @@ class ZincWidget(QtOpenGLWidgets.QOpenGLWidget):
         self._selection_box = None
         self._ignore_mouse_events = False
         self._undoRedoStack = None
+        self._view_name = 'View'
+        self._paint_measurement_name = 'View.paintGL'
         # init end
 
     def setContext(self, context):
@@ -100,6 +108,16 @@ class ZincWidget(QtOpenGLWidgets.QOpenGLWidget):
     def setUndoRedoStack(self, stack):
         self._undoRedoStack = stack
 
+    def getViewName(self):
+        return self._view_name
+
+    def setViewName(self, name):
+        '''
+        Set the name this view records its timings under.
+        '''
+        self._view_name = name
+        self._paint_measurement_name = name + '.paintGL'
+
     def getSceneviewer(self):
         """
         Get the scene viewer for this ZincWidget.
@@ -269,6 +287,31 @@ class ZincWidget(QtOpenGLWidgets.QOpenGLWidget):
 
         return None
 
+    def getPixelsPerUnit(self):
+        '''
+        Return the number of window pixels covered by a unit length
+        at the look at point, or None if the scene viewer is not ready.
+        '''
+        if self._sceneviewer is None:
+            return None
+
+        view_parameters = self.getViewParameters()
+        if view_parameters is None:
+            return None
+
+        _, lookat, up, _ = view_parameters
+        up_length = sqrt(sum([value * value for value in up]))
+        if up_length == 0.0:
+            return None
+
+        offset = [lookat[i] + up[i] / up_length for i in range(3)]
+        lookat_window = self.project(*lookat)
+        offset_window = self.project(*offset)
+        if lookat_window is None or offset_window is None:
+            return None
+
+        return sqrt((offset_window[0] - lookat_window[0]) ** 2 + (offset_window[1] - lookat_window[1]) ** 2)
+
     def setTumbleRate(self, rate):
         self._sceneviewer.setTumbleRate(rate)
 
@@ -330,7 +373,8 @@ class ZincWidget(QtOpenGLWidgets.QOpenGLWidget):
         will clear the background so any OpenGL drawing of your own needs to go after this
         API call.
         """
-        self._sceneviewer.renderScene()
+        with measure(self._paint_measurement_name):
+            self._sceneviewer.renderScene()
         # paintGL end
 
     def _zincSceneviewerEvent(self, event):
@@ -340,6 +384,8 @@ class ZincWidget(QtOpenGLWidgets.QOpenGLWidget):
         """
         if event.getChangeFlags() & Sceneviewerevent.CHANGE_FLAG_REPAINT_REQUIRED:
             QtCore.QTimer.singleShot(0, self.update)
+        if event.getChangeFlags() & Sceneviewerevent.CHANGE_FLAG_TRANSFORM:
+            self.viewportChanged.emit()
 
 #  Not applicable at the current point in time.
 #     def _zincSelectionEvent(self, event):
@@ -352,6 +398,7 @@ class ZincWidget(QtOpenGLWidgets.QOpenGLWidget):
         Respond to widget resize events.
         """
         self._sceneviewer.setViewportSize(int(width * self._pixel_scale), int(height * self._pixel_scale))
+        self.viewportChanged.emit()
         # resizeGL end
 
     def mousePressEvent(self, event):
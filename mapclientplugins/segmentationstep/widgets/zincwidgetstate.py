@@ -17,9 +17,100 @@ This file is part of MAP Client. (http://launchpad.net/mapclient)
     You should have received a copy of the GNU General Public License
     along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 """
+import time
+
+from PySide6 import QtCore
+
 from mapclientplugins.segmentationstep.widgets.zincwidget import ZincWidget
 from mapclientplugins.segmentationstep.maths.vectorops import add, sub, \
     magnitude, mult
+from mapclientplugins.segmentationstep.definitions import DEFAULT_MOUSE_MOVE_INTERVAL
+from mapclientplugins.segmentationstep.instrumentation import measure, recorder
+
+
+class MouseEventSnapshot(object):
+    '''
+    Copy of the parts of a Qt mouse event that the handlers use, the
+    Qt event object is not valid after the event handler returns.
+    '''
+
+    def __init__(self, event):
+        self._x = event.x()
+        self._y = event.y()
+        self._type = event.type()
+        self._button = event.button()
+        self._buttons = event.buttons()
+        self._modifiers = event.modifiers()
+        self._timestamp = time.perf_counter()
+
+    def x(self):
+        return self._x
+
+    def y(self):
+        return self._y
+
+    def type(self):
+        return self._type
+
+    def button(self):
+        return self._button
+
+    def buttons(self):
+        return self._buttons
+
+    def modifiers(self):
+        return self._modifiers
+
+    def getTimestamp(self):
+        return self._timestamp
+
+
+class MouseMoveStatistics(object):
+    '''
+    Counts the mouse move events received and processed, and the time
+    from receiving a mouse move event to the end of processing it.
+    '''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._received = 0
+        self._processed = 0
+        self._total_latency = 0.0
+        self._maximum_latency = 0.0
+
+    def addReceived(self):
+        self._received += 1
+
+    def addProcessed(self, latency):
+        self._processed += 1
+        self._total_latency += latency
+        self._maximum_latency = max(self._maximum_latency, latency)
+
+    def getReceivedCount(self):
+        return self._received
+
+    def getProcessedCount(self):
+        return self._processed
+
+    def getCoalescingRatio(self):
+        '''
+        The number of mouse move events received for each one processed.
+        '''
+        if self._processed == 0:
+            return 0.0
+
+        return float(self._received) / self._processed
+
+    def getMeanLatency(self):
+        if self._processed == 0:
+            return 0.0
+
+        return self._total_latency / self._processed
+
+    def getMaximumLatency(self):
+        return self._maximum_latency
 
 
 class ZincWidgetState(ZincWidget):
@@ -29,6 +120,12 @@ class ZincWidgetState(ZincWidget):
         self._initialized_view = False
         self._active_handler = None
         self._handlers = {}
+        self._pending_move_event = None
+        self._mouse_move_statistics = MouseMoveStatistics()
+        self._mouse_move_timer = QtCore.QTimer(self)
+        self._mouse_move_timer.setSingleShot(True)
+        self._mouse_move_timer.setInterval(DEFAULT_MOUSE_MOVE_INTERVAL)
+        self._mouse_move_timer.timeout.connect(self._processPendingMoveEvent)
 
     def getActiveModeType(self):
         return self._active_handler.getModeType()
@@ -36,6 +133,7 @@ class ZincWidgetState(ZincWidget):
     def setActiveModeType(self, mode):
         if (self._active_handler is None or mode != self._active_handler.getModeType()) and mode in self._handlers:
             if not self._active_handler is None:
+                self.flushMouseMoveEvents()
                 self._active_handler.leave()
             self._active_handler = self._handlers[mode]
             self._active_handler.enter()
@@ -58,14 +156,74 @@ class ZincWidgetState(ZincWidget):
     def viewAll(self):
         self._active_handler.viewAll()
 
+    def getMouseMoveInterval(self):
+        return self._mouse_move_timer.interval()
+
+    def setMouseMoveInterval(self, interval):
+        '''
+        Set the minimum time in milliseconds between processing two
+        mouse move events, an interval of zero processes every event.
+        '''
+        self.flushMouseMoveEvents()
+        self._mouse_move_timer.setInterval(interval)
+
+    def getMouseMoveStatistics(self):
+        return self._mouse_move_statistics
+
+    def flushMouseMoveEvents(self):
+        '''
+        Process the pending mouse move event now, the handler must see
+        the latest mouse position before a press or release event.
+        '''
+        self._mouse_move_timer.stop()
+        self._processPendingMoveEvent()
+
+    def _processPendingMoveEvent(self):
+        if self._pending_move_event is None:
+            return
+
+        event = self._pending_move_event
+        self._pending_move_event = None
+        with self._measureHandler('mouseMoveEvent'):
+            self._active_handler.mouseMoveEvent(event)
+        self._mouse_move_statistics.addProcessed(time.perf_counter() - event.getTimestamp())
+        if self._mouse_move_timer.interval() > 0:
+            self._mouse_move_timer.start()
+
     def mousePressEvent(self, event):
-        self._active_handler.mousePressEvent(event)
+        self.flushMouseMoveEvents()
+        with self._measureHandler('mousePressEvent'):
+            self._active_handler.mousePressEvent(event)
 
     def mouseMoveEvent(self, event):
-        self._active_handler.mouseMoveEvent(event)
+        '''
+        Mouse move events are coalesced, a move event arriving while the
+        previous one is still within the mouse move interval replaces any
+        pending move event and only the latest one is processed when the
+        interval ends.
+        '''
+        self._mouse_move_statistics.addReceived()
+        self._pending_move_event = MouseEventSnapshot(event)
+        if not self._mouse_move_timer.isActive():
+            self._processPendingMoveEvent()
 
     def mouseReleaseEvent(self, event):
-        self._active_handler.mouseReleaseEvent(event)
+        self.flushMouseMoveEvents()
+        with self._measureHandler('mouseReleaseEvent'):
+            self._active_handler.mouseReleaseEvent(event)
+
+    def _measureHandler(self, event_name):
+        '''
+        The measurement name is only built when the recorder is enabled,
+        this is called for every mouse event.
+        '''
+        if not recorder.isEnabled():
+            return measure(None)
+
+        return measure(self._handlerMeasurementName(event_name))
+
+    def _handlerMeasurementName(self, event_name):
+        return '.'.join([self._view_name, self._active_handler.__class__.__name__, event_name])
 
     def setPlane(self, plane):
         self._plane = plane
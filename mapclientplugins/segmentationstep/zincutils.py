@@ -17,8 +17,6 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
 '''
-from PySide6 import QtCore
-
 from cmlibs.zinc.sceneviewerinput import Sceneviewerinput
 from cmlibs.zinc.element import Element, Elementbasis
 from cmlibs.zinc.field import Field
@@ -32,22 +30,6 @@ COORDINATE_SYSTEM_WINDOW_PIXEL_TOP_LEFT = SCENECOORDINATESYSTEM_WINDOW_PIXEL_TOP
 from mapclientplugins.segmentationstep.definitions import DEFAULT_GRAPHICS_SPHERE_SIZE, DEFAULT_NORMAL_ARROW_SIZE, \
     PLANE_MANIPULATION_SPHERE_GRAPHIC_NAME, PLANE_MANIPULATION_NORMAL_GRAPHIC_NAME
 
-button_map = {
-    QtCore.Qt.MouseButton.LeftButton: Sceneviewerinput.BUTTON_TYPE_LEFT,
-    QtCore.Qt.MouseButton.MiddleButton: Sceneviewerinput.BUTTON_TYPE_MIDDLE,
-    QtCore.Qt.MouseButton.RightButton: Sceneviewerinput.BUTTON_TYPE_RIGHT
-}
-# Create a modifier map of Qt modifier keys to Zinc modifier keys
-def modifier_map(qt_modifiers):
-    '''
-    Return a Zinc SceneViewerInput modifiers object that is created from
-    the Qt modifier flags passed in.
-    '''
-    modifiers = Sceneviewerinput.MODIFIER_FLAG_NONE
-    if qt_modifiers & QtCore.Qt.KeyboardModifier.ShiftModifier:
-        modifiers = modifiers | Sceneviewerinput.MODIFIER_FLAG_SHIFT
-
-    return modifiers
 
 def createFiniteElementField(region):
     '''
@@ -71,8 +53,13 @@ def createFiniteElementField(region):
     return finite_element_field
 
 
-def create1DFiniteElement(finite_element_field, node1, node2):
-    # Use a 3D mesh to to create the 3D finite element.
+def create1DElementtemplate(finite_element_field, basis_function_type=Elementbasis.FUNCTION_TYPE_LINEAR_LAGRANGE):
+    '''
+    Create an element template for two node line elements that
+    interpolate the given finite element field with the given basis.
+    The template can be reused by setting the nodes before
+    each element is created.
+    '''
     fieldmodule = finite_element_field.getFieldmodule()
     mesh = fieldmodule.findMeshByDimension(1)
     element_template = mesh.createElementtemplate()
@@ -80,13 +67,22 @@ def create1DFiniteElement(finite_element_field, node1, node2):
     element_node_count = 2
     element_template.setNumberOfNodes(element_node_count)
     # Specify the dimension and the interpolation function for the element basis function
-    linear_basis = fieldmodule.createElementbasis(1, Elementbasis.FUNCTION_TYPE_LINEAR_LAGRANGE)
+    basis = fieldmodule.createElementbasis(1, basis_function_type)
     # the indecies of the nodes in the node template we want to use.
     node_indexes = [1, 2]
 
     # Define a nodally interpolated element field or field component in the
     # element_template
-    element_template.defineFieldSimpleNodal(finite_element_field, -1, linear_basis, node_indexes)
+    element_template.defineFieldSimpleNodal(finite_element_field, -1, basis, node_indexes)
+
+    return element_template
+
+
+def create1DFiniteElement(finite_element_field, node1, node2, basis_function_type=Elementbasis.FUNCTION_TYPE_LINEAR_LAGRANGE):
+    # Use a 1D mesh to to create the 1D finite element.
+    fieldmodule = finite_element_field.getFieldmodule()
+    mesh = fieldmodule.findMeshByDimension(1)
+    element_template = create1DElementtemplate(finite_element_field, basis_function_type)
     element_template.setNode(1, node1)
     element_template.setNode(2, node2)
 
@@ -62,7 +62,7 @@ setup(name=u'mapclientplugins.segmentationstep',
       author_email='',
       url='https://github.com/mapclient-plugins/segmentationstep',
       license='APACHE',
-      packages=find_packages(exclude=['ez_setup', ]),
+      packages=find_packages(exclude=['ez_setup', 'tests', 'tests.*']),
       namespace_packages=['mapclientplugins'],
       include_package_data=True,
       zip_safe=False,
@@ -0,0 +1,141 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import math
+import unittest
+
+import numpy as np
+
+from cmlibs.zinc.context import Context
+
+from mapclientplugins.segmentationstep.definitions import SamplingMode
+from mapclientplugins.segmentationstep.model.curve import CurveModel
+from mapclientplugins.segmentationstep.model.node import NodeModel
+from mapclientplugins.segmentationstep.plane import Plane, PlaneAttitude
+
+RADIUS = 50.0
+
+
+class CurveModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._context = Context('curvemodel')
+        region = self._context.getDefaultRegion().createChild('image')
+        self._node_model = NodeModel(self._context)
+        self._node_model.setPlane(Plane(region.getFieldmodule()))
+        self._node_model.initialize()
+
+    def _createCurve(self, locations, closed=False):
+        plane_attitude = PlaneAttitude([0.0, 0.0, 0.0], [0.0, 0.0, 1.0])
+        curve_group = self._node_model.getCurveGroup()
+        curve = CurveModel(self._node_model)
+        for location in locations:
+            node_id = self._node_model.addNode(-1, location, plane_attitude)
+            curve_group.addNode(self._node_model.getNodeByIdentifier(node_id))
+            curve.addNode(node_id)
+        if closed:
+            curve.addNode(curve.getNodes()[0])
+        self._node_model.insertCurve(0, curve)
+
+        return curve
+
+    def _createCircle(self, count=12):
+        return self._createCurve([[RADIUS * math.cos(2 * math.pi * i / count), RADIUS * math.sin(2 * math.pi * i / count), 0.0] for i in range(count)], True)
+
+    def testParametricSampleCount(self):
+        curve = self._createCurve([[0.0, 0.0, 0.0], [10.0, 5.0, 0.0], [20.0, 0.0, 0.0], [30.0, 5.0, 0.0]])
+        curve.setInterpolationCount(4)
+        self.assertEqual(curve.calculateArray().shape, (3 * 4, 3))
+        self.assertEqual(curve.calculate(), curve.calculateArray().tolist())
+
+    def testArcLengthSamplesEvenlySpaced(self):
+        curve = self._createCircle()
+        spacing = 2.0
+        curve.setSamplingMode(SamplingMode.ARC_LENGTH)
+        curve.setSampleSpacing(spacing)
+        samples = curve.calculateArray()
+        circumference = 2 * math.pi * RADIUS
+        self.assertAlmostEqual(len(samples), circumference / spacing, delta=2)
+        # On a circle every sample lies on the circle and the chord
+        # between samples at an arc length spacing apart is fixed.
+        expected_chord = 2 * RADIUS * math.sin(spacing / (2 * RADIUS))
+        chords = np.linalg.norm(np.diff(samples, axis=0), axis=1)
+        np.testing.assert_allclose(chords, expected_chord, rtol=0.02)
+        self.assertAlmostEqual(np.linalg.norm(samples[0] - [RADIUS, 0.0, 0.0]), expected_chord, delta=0.02 * spacing)
+        np.testing.assert_allclose(np.linalg.norm(samples, axis=1), RADIUS, rtol=0.01)
+
+    def testArcLengthSpacingLongerThanCurve(self):
+        curve = self._createCurve([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [2.0, 0.0, 0.0]])
+        curve.setSamplingMode(SamplingMode.ARC_LENGTH)
+        curve.setSampleSpacing(10.0)
+        self.assertEqual(len(curve.calculateArray()), 0)
+
+    def testArcLengthFollowsScale(self):
+        curve = self._createCurve([[0.0, 0.0, 0.0], [10.0, 0.0, 0.0], [20.0, 0.0, 0.0]])
+        curve.setSamplingMode(SamplingMode.ARC_LENGTH)
+        curve.setSampleSpacing(1.0)
+        unscaled_count = len(curve.calculateArray())
+        self._node_model.setScale([2.0, 1.0, 1.0])
+        self.assertAlmostEqual(len(curve.calculateArray()), 2 * unscaled_count, delta=1)
+
+    def _adaptiveParameters(self, curve):
+        _, coefficients = curve._getCoefficients()
+        parameters = curve._calculateAdaptiveParameters(coefficients)
+
+        return coefficients, np.sort(np.concatenate([np.arange(len(coefficients) + 1, dtype=np.float64), parameters]))
+
+    def testAdaptiveWithinTolerance(self):
+        curve = self._createCircle(6)
+        tolerance = 0.05
+        curve.setSamplingMode(SamplingMode.ADAPTIVE)
+        curve.setSampleTolerance(tolerance)
+        coefficients, parameters = self._adaptiveParameters(curve)
+        self.assertEqual(len(curve.calculateArray()), len(parameters) - len(coefficients) - 1)
+        # Test the deviation from each chord at more points than the
+        # sampling itself tests, allowing for the points in between.
+        fractions = np.linspace(0.0, 1.0, 17)[1:-1]
+        for t0, t1 in zip(parameters[:-1], parameters[1:]):
+            start, end = curve._evaluateParameters(coefficients, np.array([t0, t1]))
+            points = curve._evaluateParameters(coefficients, t0 + (t1 - t0) * fractions)
+            chord = end - start
+            projection = np.clip(np.dot(points - start, chord) / np.dot(chord, chord), 0.0, 1.0)
+            deviation = np.linalg.norm(points - start - projection[:, np.newaxis] * chord, axis=1)
+            self.assertLess(deviation.max(), 1.5 * tolerance)
+
+    def testAdaptiveTighterToleranceAddsSamples(self):
+        curve = self._createCircle(6)
+        curve.setSamplingMode(SamplingMode.ADAPTIVE)
+        counts = []
+        for tolerance in [1.0, 0.1, 0.01]:
+            curve.setSampleTolerance(tolerance)
+            counts.append(len(curve.calculateArray()))
+        self.assertLess(counts[0], counts[1])
+        self.assertLess(counts[1], counts[2])
+
+    def testAdaptiveStraightLineHasNoSamples(self):
+        curve = self._createCurve([[0.0, 0.0, 0.0], [10.0, 0.0, 0.0], [20.0, 0.0, 0.0]])
+        curve.setSamplingMode(SamplingMode.ADAPTIVE)
+        curve.setSampleTolerance(0.01)
+        self.assertEqual(len(curve.calculateArray()), 0)
+        polyline = curve.calculatePolyline()
+        np.testing.assert_allclose(polyline, [[0.0, 0.0, 0.0], [10.0, 0.0, 0.0], [20.0, 0.0, 0.0]], atol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import random
+import unittest
+
+from mapclientplugins.segmentationstep.model.identifierset import IdentifierSet
+
+
+class IdentifierSetTestCase(unittest.TestCase):
+
+    def testRanges(self):
+        identifier_set = IdentifierSet([5, 1, 2, 3, 7, 8, 2])
+        self.assertEqual(list(identifier_set.ranges()), [(1, 4), (5, 6), (7, 9)])
+        self.assertEqual(identifier_set.getRangeCount(), 3)
+        self.assertEqual(len(identifier_set), 6)
+        self.assertEqual(list(identifier_set), [1, 2, 3, 5, 7, 8])
+
+    def testEmpty(self):
+        identifier_set = IdentifierSet()
+        self.assertFalse(identifier_set)
+        self.assertEqual(len(identifier_set), 0)
+        self.assertEqual(list(identifier_set), [])
+        self.assertNotIn(1, identifier_set)
+
+    def testContains(self):
+        identifier_set = IdentifierSet.fromRanges([(1, 4), (10, 11)])
+        for identifier in range(-1, 13):
+            self.assertEqual(identifier in identifier_set, identifier in (1, 2, 3, 10))
+
+    def testEquality(self):
+        self.assertEqual(IdentifierSet([1, 2, 3]), IdentifierSet.fromRanges([(1, 4)]))
+        self.assertNotEqual(IdentifierSet([1, 2, 3]), IdentifierSet([1, 3]))
+        self.assertNotEqual(IdentifierSet([1]), [1])
+
+    def testOperationsMatchSets(self):
+        generator = random.Random(0)
+        for _ in range(50):
+            a = set(generator.sample(range(100), generator.randint(0, 60)))
+            b = set(generator.sample(range(100), generator.randint(0, 60)))
+            set_a = IdentifierSet(a)
+            set_b = IdentifierSet(b)
+            for result, expected in [(set_a | set_b, a | b), (set_a & set_b, a & b), (set_a - set_b, a - b)]:
+                self.assertEqual(list(result), sorted(expected))
+                self.assertEqual(result, IdentifierSet(expected))
+
+    def testCombinedRangesAreMerged(self):
+        union = IdentifierSet([1, 2]) | IdentifierSet([3, 4])
+        self.assertEqual(list(union.ranges()), [(1, 5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
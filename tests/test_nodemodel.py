@@ -0,0 +1,78 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import unittest
+
+import numpy as np
+
+from cmlibs.zinc.context import Context
+
+from mapclientplugins.segmentationstep.model.node import NodeModel
+from mapclientplugins.segmentationstep.plane import Plane, PlaneAttitude
+
+
+class NodeModelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._context = Context('nodemodel')
+        region = self._context.getDefaultRegion().createChild('image')
+        self._node_model = NodeModel(self._context)
+        self._node_model.setPlane(Plane(region.getFieldmodule()))
+        self._node_model.initialize()
+
+    def _addPoints(self, count):
+        random = np.random.RandomState(0)
+        plane_attitude = PlaneAttitude([0.0, 0.0, 0.0], [0.0, 0.0, 1.0])
+        point_cloud_group = self._node_model.getPointCloudGroup()
+        for location in random.uniform(-1000.0, 1000.0, (count, 3)) / 3.0:
+            node_id = self._node_model.addNode(-1, location.tolist(), plane_attitude)
+            point_cloud_group.addNode(self._node_model.getNodeByIdentifier(node_id))
+
+    def _evaluateLocation(self, node_id):
+        fieldmodule = self._node_model.getRegion().getFieldmodule()
+        fieldcache = fieldmodule.createFieldcache()
+        fieldcache.setNode(self._node_model.getNodeByIdentifier(node_id))
+        _, location = self._node_model.getCoordinateField().evaluateReal(fieldcache, 3)
+
+        return location
+
+    def testReadNodesetCoordinatesMatchesEvaluateReal(self):
+        self._addPoints(50)
+        identifiers, locations = self._node_model.readNodesetCoordinates(self._node_model.getPointCloudGroup())
+        self.assertEqual(len(identifiers), 50)
+        for node_id, location in zip(identifiers.tolist(), locations.tolist()):
+            self.assertEqual(location, self._evaluateLocation(node_id))
+
+    def testIterateNodesetCoordinatesChunks(self):
+        self._addPoints(50)
+        group = self._node_model.getPointCloudGroup()
+        identifiers, locations = self._node_model.readNodesetCoordinates(group)
+        chunks = [(chunk_identifiers.copy(), chunk_locations.copy()) for chunk_identifiers, chunk_locations in self._node_model.iterateNodesetCoordinates(group, 7)]
+        self.assertEqual([len(chunk[0]) for chunk in chunks], [7] * 7 + [1])
+        np.testing.assert_array_equal(np.concatenate([chunk[0] for chunk in chunks]), identifiers)
+        np.testing.assert_array_equal(np.concatenate([chunk[1] for chunk in chunks]), locations)
+
+    def testReadEmptyNodeset(self):
+        identifiers, locations = self._node_model.readNodesetCoordinates(self._node_model.getPointCloudGroup())
+        self.assertEqual(identifiers.shape, (0,))
+        self.assertEqual(locations.shape, (0, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+'''
+MAP Client, a program to generate detailed musculoskeletal models for OpenSim.
+    Copyright (C) 2012  University of Auckland
+    
+This file is part of MAP Client. (http://launchpad.net/mapclient)
+
+    MAP Client is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    MAP Client is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with MAP Client.  If not, see <http://www.gnu.org/licenses/>..
+'''
+import json
+import unittest
+
+from mapclientplugins.segmentationstep.definitions import PointSource
+from mapclientplugins.segmentationstep.model.nodestate import NODE_STATE_VERSION, parseNodeState, parseChangeRecords
+
+
+def _createState(**entries):
+    state = {'_version': NODE_STATE_VERSION,
+             '_basic_points': {'1': [0.0, 0.0, 0.0]},
+             '_curve_points': {'2': [1.0, 0.0, 0.0], '3': [0.0, 1.0, 0.0]},
+             '_selection': [1],
+             '_plane': {'normal': [0.0, 0.0, 1.0], 'point': [0.0, 0.0, 0.0]},
+             '_curves': {'0': {'_nodes': [2, 3], '_closed': False}},
+             '_plane_attitude_store': [{'_point': [0.0, 0.0, 0.0], '_normal': [0.0, 0.0, 1.0]}],
+             '_nodes': {'1': 0, '2': 0, '3': 0},
+             '_plane_attitudes': {}}
+    state.update(entries)
+
+    return json.dumps(state)
+
+
+def _createRecord(nodes=None, curves=None):
+    return {'_attitudes': [[[0.0, 0.0, 0.0], [0.0, 0.0, 1.0]]],
+            '_nodes': nodes or {},
+            '_curves': dict((key, None if curve is None else json.dumps(curve)) for key, curve in (curves or {}).items()),
+            '_plane': {'normal': [0.0, 0.0, 1.0], 'point': [0.0, 0.0, 0.0]}}
+
+
+class ParseNodeStateTestCase(unittest.TestCase):
+
+    def testParseState(self):
+        state = parseNodeState(_createState())
+        self.assertEqual(state['version'], NODE_STATE_VERSION)
+        self.assertEqual(state['basic_points'], ([1], [[0.0, 0.0, 0.0]]))
+        self.assertEqual(sorted(state['curve_points'][0]), [2, 3])
+        self.assertEqual(state['curves'], {0: {'_nodes': [2, 3], '_closed': False}})
+        self.assertEqual(state['node_attitudes'], {1: 0, 2: 0, 3: 0})
+        self.assertEqual(state['selection'], [1])
+
+    def testParseVersion1(self):
+        d = json.loads(_createState())
+        del d['_version']
+        del d['_selection']
+        state = parseNodeState(json.dumps(d))
+        self.assertEqual(state['version'], 1)
+        self.assertEqual(state['selection'], [])
+
+    def testUnusedAttitudesDropped(self):
+        store = [{'_point': [0.0, 0.0, 0.0], '_normal': [0.0, 0.0, 1.0]}, {'_point': [1.0, 0.0, 0.0], '_normal': [1.0, 0.0, 0.0]}]
+        state = parseNodeState(_createState(_plane_attitude_store=store))
+        self.assertIsNone(state['attitudes'][1])
+
+    def testUnknownEntriesIgnored(self):
+        parseNodeState(_createState(_generation='abc', _unknown=[1, 2]))
+
+    def testRejectUnknownVersion(self):
+        self.assertRaises(ValueError, parseNodeState, _createState(_version=NODE_STATE_VERSION + 1))
+
+    def testRejectMalformed(self):
+        for str_rep in ['', '{', '[]', json.dumps({'_basic_points': {}})]:
+            self.assertRaises(ValueError, parseNodeState, str_rep)
+
+    def testRejectInvalidEntries(self):
+        invalid_entries = [
+            {'_basic_points': {'a': [0.0, 0.0, 0.0]}},
+            {'_basic_points': {'-1': [0.0, 0.0, 0.0]}},
+            {'_basic_points': {'1': [0.0, 0.0]}},
+            {'_basic_points': {'1': [0.0, 0.0, True]}},
+            {'_basic_points': {'1': [0.0, 0.0, 0.0], '2': [0.0, 0.0, 0.0]}},
+            {'_curves': {'0': {'_nodes': [2, 2]}}},
+            {'_curves': {'0': {'_nodes': [2, 1]}}},
+            {'_curves': {'0': {'_nodes': [2, 3], '_sampling_mode': 'unknown'}}},
+            {'_curves': {'0': {'_nodes': [2, 3], '_closed': 1}}},
+            {'_nodes': {'1': 0, '2': 0}},
+            {'_nodes': {'1': 0, '2': 0, '3': 1}},
+            {'_nodes': {'1': 0, '2': 0, '3': 0, '4': 0}},
+            {'_plane': {'normal': [0.0, 0.0, 1.0]}},
+            {'_selection': 1},
+        ]
+        for entries in invalid_entries:
+            self.assertRaises(ValueError, parseNodeState, _createState(**entries))
+
+
+class ParseChangeRecordsTestCase(unittest.TestCase):
+
+    def _parse(self, records):
+        return parseChangeRecords([2, 3], {0: {'_nodes': [2, 3]}}, records)
+
+    def testParseRecords(self):
+        records = self._parse([_createRecord({'4': [PointSource.CURVE_CONTROL, [1.0, 1.0, 0.0], 0]}, {'0': {'_nodes': [2, 3, 4]}}),
+                               _createRecord({'2': None}, {'0': {'_nodes': [3, 4]}}),
+                               _createRecord({'5': [PointSource.POINT, [2.0, 0.0, 0.0], 0]})])
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]['nodes'], {4: (PointSource.CURVE_CONTROL, [1.0, 1.0, 0.0], 0)})
+        self.assertEqual(records[1]['nodes'], {2: None})
+        self.assertEqual(records[1]['curves'], {0: {'_nodes': [3, 4]}})
+
+    def testRemoveCurve(self):
+        self._parse([_createRecord({'2': None, '3': None}, {'0': None})])
+
+    def testRejectInvalidRecords(self):
+        invalid_records = [
+            [],
+            {'_nodes': {}},
+            _createRecord({'4': [PointSource.POINT, [0.0, 0.0], 0]}),
+            _createRecord({'4': [PointSource.INTERPOLATION, [0.0, 0.0, 0.0], 0]}),
+            _createRecord({'4': [True, [0.0, 0.0, 0.0], 0]}),
+            _createRecord({'4': [PointSource.POINT, [0.0, 0.0, 0.0], 1]}),
+            _createRecord({'x': None}),
+            _createRecord(curves={'0': {'_nodes': [2, 3, 9]}}),
+            _createRecord(curves={'0': {'_nodes': [2, 2]}}),
+        ]
+        for record in invalid_records:
+            self.assertRaises(ValueError, self._parse, [record])
+
+    def testRejectMalformedCurve(self):
+        record = _createRecord()
+        record['_curves'] = {'0': '{"_nodes": ['}
+        self.assertRaises(ValueError, self._parse, [record])
+
+    def testRejectRemovedCurveNode(self):
+        self.assertRaises(ValueError, self._parse, [_createRecord({'2': None})])
+        self.assertRaises(ValueError, self._parse, [_createRecord({'2': [PointSource.POINT, [0.0, 0.0, 0.0], 0]})])
+
+    def testRejectLaterRecord(self):
+        records = [_createRecord({'4': [PointSource.POINT, [0.0, 0.0, 0.0], 0]}), _createRecord(curves={'0': {'_nodes': [2, 3, 4]}})]
+        self.assertRaises(ValueError, self._parse, records)
+
+
+if __name__ == '__main__':
+    unittest.main()